@@ -57,6 +57,7 @@ def sample(req, res):
 app.add_route("/sample", sample)
 
 @app.route("/html")
+@app.cache(ttl=60)
 def html(request, response):
     response.body = app.template("index.html", {"title": "Aswone Frameworke", "name":"Nanjia Framework"}).encode("utf-8")
 
@@ -79,6 +80,7 @@ app.add_middleware(SimpleCustomMiddleware)
 
 
 @app.route("/template")
+@app.cache(ttl=60)
 def template_handler(req, resp):
     resp.html = app.template("index.html", context={"name": "Bumbo", "title": "Best Framework"})
 
@@ -0,0 +1,113 @@
+import inspect
+import os
+import tempfile
+import timeit
+
+from bumbov.orm import Column, Database, ForeignKey, Table
+
+
+NUMBER = 2000
+
+
+class Author(Table):
+    name = Column(str)
+    age = Column(int)
+
+
+class Book(Table):
+    title = Column(str)
+    published = Column(bool)
+    author = ForeignKey(Author)
+
+
+# how Table built its SQL before the per-class cache: inspect.getmembers on every call
+
+def legacy_insert_sql(self):
+    fields, placeholders, values = [], [], []
+    for name, field in inspect.getmembers(self.__class__):
+        if isinstance(field, Column):
+            fields.append(name)
+            values.append(getattr(self, name))
+            placeholders.append("?")
+        elif isinstance(field, ForeignKey):
+            fields.append(name + "_id")
+            values.append(getattr(self, name).id)
+            placeholders.append("?")
+    sql = "INSERT INTO {name} ({fields}) VALUES ({placeholders});".format(
+        name=self.__class__.__name__.lower(), fields=", ".join(fields), placeholders=", ".join(placeholders)
+    )
+    return sql, values
+
+
+def legacy_select_where_sql(cls, id):
+    fields = ["id"]
+    for name, field in inspect.getmembers(cls):
+        if isinstance(field, Column):
+            fields.append(name)
+        elif isinstance(field, ForeignKey):
+            fields.append(name + "_id")
+    sql = "SELECT {fields} FROM {name} WHERE id = ?;".format(fields=", ".join(fields), name=cls.__name__.lower())
+    return sql, fields, [id]
+
+
+def legacy_update_sql(self):
+    fields, values = [], []
+    for name, field in inspect.getmembers(self.__class__):
+        if isinstance(field, Column):
+            fields.append(f"{name} = ?")
+            values.append(getattr(self, name))
+        elif isinstance(field, ForeignKey):
+            fields.append(f"{name}_id = ?")
+            values.append(getattr(self, name).id)
+    values.append(getattr(self, "id"))
+    sql = "UPDATE {name} SET {fields} WHERE id = ?;".format(name=self.__class__.__name__.lower(), fields=", ".join(fields))
+    return sql, values
+
+
+def run_operations(db, author):
+    results = {}
+    results["save"] = timeit.timeit(lambda: db.save(Book(title="Dune", published=True, author=author)), number=NUMBER)
+    book = db.get(Book, id=1)
+    results["get"] = timeit.timeit(lambda: db.get(Book, id=1), number=NUMBER)
+    results["update"] = timeit.timeit(lambda: db.update(book), number=NUMBER)
+    return results
+
+
+def measure(patched):
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, "bench.db"), pragmas={"synchronous": "OFF"})
+        db.create(Author)
+        db.create(Book)
+        author = Author(name="Frank Herbert", age=65)
+        db.save(author)
+
+        originals = {}
+        if patched:
+            for cls, name, legacy in (
+                (Table, "_get_insert_sql", legacy_insert_sql),
+                (Table, "_get_select_where_sql", classmethod(legacy_select_where_sql)),
+                (Table, "_get_update_sql", legacy_update_sql),
+            ):
+                originals[name] = cls.__dict__[name]
+                setattr(cls, name, legacy)
+        try:
+            return run_operations(db, author)
+        finally:
+            for name, original in originals.items():
+                setattr(Table, name, original)
+            db.close()
+
+
+def main():
+    before = measure(patched=True)
+    after = measure(patched=False)
+    print(f"{'operation':>10} {'before (us)':>12} {'after (us)':>11} {'speedup':>8}")
+    for operation in before:
+        print(
+            f"{operation:>10} {before[operation] / NUMBER * 1e6:>12.1f} "
+            f"{after[operation] / NUMBER * 1e6:>11.1f} {before[operation] / after[operation]:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import json
+import timeit
+
+from webob import Response as WebObResponse
+
+from bumbov.response import Response
+
+
+NUMBER = 50000
+ENVIRON = {"REQUEST_METHOD": "GET"}
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def webob_response(resp):
+    # what Response.__call__ did before the fast path
+    if resp.json is not None:
+        resp.body = json.dumps(resp.json).encode("UTF-8")
+        resp.content_type = "application/json"
+    if resp.html is not None:
+        resp.body = resp.html.encode("UTF-8")
+        resp.content_type = "text/html"
+    if resp.text is not None:
+        resp.body = resp.text
+        resp.content_type = "text/plain"
+    response = WebObResponse(body=resp.body, content_type=resp.content_type, status=resp.status_code)
+    return response(ENVIRON, start_response)
+
+
+def fast_response(resp):
+    return resp(ENVIRON, start_response)
+
+
+def make_text():
+    resp = Response()
+    resp.text = "Hello, World"
+    return resp
+
+
+def make_json():
+    resp = Response()
+    resp.json = {"name": "data", "type": "JSON"}
+    return resp
+
+
+def make_html():
+    resp = Response()
+    resp.html = "<h1>Hello, World</h1>"
+    return resp
+
+
+def main():
+    print(f"{'response':>10} {'webob (req/s)':>14} {'fast (req/s)':>13} {'speedup':>8}")
+    for label, factory in (("text", make_text), ("json", make_json), ("html", make_html)):
+        webob = timeit.timeit(lambda: webob_response(factory()), number=NUMBER)
+        fast = timeit.timeit(lambda: fast_response(factory()), number=NUMBER)
+        print(f"{label:>10} {NUMBER / webob:>14.0f} {NUMBER / fast:>13.0f} {webob / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+import timeit
+
+from parse import parse
+
+from bumbov.api import API
+
+
+ROUTE_COUNTS = (10, 100, 1000)
+REPETITIONS = 2000
+
+
+def linear_find_handler(routes, request_path):
+    for path, handler_data in routes.items():
+        parse_result = parse(path, request_path)
+        if parse_result is not None:
+            return handler_data, parse_result.named
+    return None, None
+
+
+def build_api(count):
+    api = API()
+    for i in range(count):
+        api.add_route(f"/resource{i}/{{id:d}}", lambda req, res, id: None)
+    return api
+
+
+def main():
+    print(f"{'routes':>8} {'path':>8} {'linear (us)':>12} {'trie (us)':>10} {'speedup':>8}")
+    for count in ROUTE_COUNTS:
+        api = build_api(count)
+        number = max(3, REPETITIONS // count)
+        paths = {
+            "first": "/resource0/42",
+            "last": f"/resource{count - 1}/42",
+            "404": "/missing/42",
+        }
+        for label, path in paths.items():
+            linear = timeit.timeit(lambda: linear_find_handler(api.routes, path), number=number)
+            trie = timeit.timeit(lambda: api.find_handler(path), number=number)
+            print(
+                f"{count:>8} {label:>8} {linear / number * 1e6:>12.2f} "
+                f"{trie / number * 1e6:>10.2f} {linear / trie:>7.1f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
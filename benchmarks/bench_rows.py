@@ -0,0 +1,67 @@
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bumbov.orm import Column, Database, Table
+
+
+class Author(Table):
+    name = Column(str)
+    age = Column(int)
+
+
+class LegacyRow:
+    # how Table instances stored their fields before __slots__
+
+    def __init__(self, **kwargs):
+        self._data = {"id": None}
+        for key, value in kwargs.items():
+            self._data[key] = value
+
+    def __getattribute__(self, key):
+        _data = super().__getattribute__("_data")
+        if key in _data:
+            return _data[key]
+        return super().__getattribute__(key)
+
+
+def load_legacy(db):
+    sql, fields = Author._get_select_all_sql()
+    return [LegacyRow(**dict(zip(fields, row))) for row in db.conn.execute(sql)]
+
+
+def measure(label, load, access):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    rows = load()
+    load_time = time.perf_counter() - started
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    access(rows)
+    access_time = time.perf_counter() - started
+    print(f"{label:>8} {load_time:>9.2f}s {memory / 2**20:>10.1f}MB {access_time:>10.3f}s")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, "rows.db"))
+        db.create(Author)
+        db.bulk_save(Author(name=f"Author {i}", age=i % 100) for i in range(count))
+
+        print(f"{count} rows")
+        print(f"{'mode':>8} {'load':>10} {'memory':>12} {'access':>11}")
+        measure("legacy", lambda: load_legacy(db), lambda rows: sum(row.age for row in rows))
+        measure("slots", lambda: db.all(Author), lambda rows: sum(row.age for row in rows))
+        measure("tuples", lambda: db.query(Author).tuples("id", "name", "age"), lambda rows: sum(row[2] for row in rows))
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import sys
+from io import BytesIO
+from time import perf_counter
+
+
+def make_environ(path, method="GET", body=b"", headers=None):
+    environ = {
+        "REQUEST_METHOD": method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": path,
+        "QUERY_STRING": "",
+        "SERVER_NAME": "testserver",
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": False,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in (headers or {}).items():
+        environ[f"HTTP_{name.upper().replace('-', '_')}"] = value
+    return environ
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def request(app, path, method="GET", body=b"", headers=None):
+    # what a WSGI server does for one request: call the app, drain and close the body
+    app_iter = app(make_environ(path, method, body, headers), start_response)
+    try:
+        for _ in app_iter:
+            pass
+    finally:
+        close = getattr(app_iter, "close", None)
+        if close is not None:
+            close()
+
+
+def measure(func, number, warmup=None):
+    for _ in range(number // 10 if warmup is None else warmup):
+        func()
+
+    timings = []
+    started = perf_counter()
+    for _ in range(number):
+        start = perf_counter()
+        func()
+        timings.append(perf_counter() - start)
+    total = perf_counter() - started
+
+    timings.sort()
+    return {
+        "number": number,
+        "ops_per_sec": number / total,
+        "mean_us": total / number * 1e6,
+        "p50_us": _percentile(timings, 0.5) * 1e6,
+        "p95_us": _percentile(timings, 0.95) * 1e6,
+        "p99_us": _percentile(timings, 0.99) * 1e6,
+    }
+
+
+def _percentile(timings, quantile):
+    return timings[min(len(timings) - 1, int(quantile * len(timings)))]
@@ -0,0 +1,246 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+from bench_routing import build_api
+from harness import measure, request
+
+from bumbov.api import API
+from bumbov.middleware import Middleware
+from bumbov.orm import Column, Database, ForeignKey, Table
+
+
+BENCHMARKS = []
+
+
+def benchmark(name, number):
+    def register(setup):
+        BENCHMARKS.append((name, number, contextmanager(setup)))
+        return setup
+    return register
+
+
+class Author(Table):
+    name = Column(str)
+    age = Column(int)
+
+
+class Book(Table):
+    title = Column(str)
+    published = Column(bool)
+    author = ForeignKey(Author)
+
+
+# routing
+
+def _routing(count, path):
+    api = build_api(count)
+    yield lambda: request(api, path)
+
+
+for _count in (10, 100, 1000):
+    benchmark(f"routing/{_count}-first", 5000)(lambda count=_count: _routing(count, "/resource0/42"))
+    benchmark(f"routing/{_count}-last", 5000)(lambda count=_count: _routing(count, f"/resource{count - 1}/42"))
+    benchmark(f"routing/{_count}-404", 5000)(lambda count=_count: _routing(count, "/missing/42"))
+
+
+# responses
+
+@benchmark("response/text", 10000)
+def response_text():
+    api = API()
+
+    @api.route("/text")
+    def text(req, resp):
+        resp.text = "Hello, World"
+
+    yield lambda: request(api, "/text")
+
+
+@benchmark("response/json", 10000)
+def response_json():
+    api = API()
+    payload = {"books": [{"id": i, "title": f"Book {i}", "published": True} for i in range(20)]}
+
+    @api.route("/json")
+    def json_handler(req, resp):
+        resp.json = payload
+
+    yield lambda: request(api, "/json")
+
+
+@benchmark("response/template", 5000)
+def response_template():
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "index.html"), "w") as f:
+            f.write("<h1>{{ title }}</h1><ul>{% for name in names %}<li>{{ name }}</li>{% endfor %}</ul>")
+        api = API(template_dir=directory, template_auto_reload=False, precompile_templates=True)
+
+        @api.route("/template")
+        def template(req, resp):
+            resp.html = api.template("index.html", context={"title": "Books", "names": ["a", "b", "c"] * 10})
+
+        yield lambda: request(api, "/template")
+
+
+# middleware
+
+class PassThroughMiddleware(Middleware):
+    def process_request(self, req):
+        pass
+
+    def process_response(self, req, resp):
+        pass
+
+
+def _middleware(depth):
+    api = API()
+
+    @api.route("/home")
+    def home(req, resp):
+        resp.text = "Home"
+
+    for _ in range(depth):
+        api.add_middleware(PassThroughMiddleware)
+    yield lambda: request(api, "/home")
+
+
+for _depth in (0, 5, 20):
+    benchmark(f"middleware/depth-{_depth}", 10000)(lambda depth=_depth: _middleware(depth))
+
+
+# static files
+
+@benchmark("static/file", 5000)
+def static_file():
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, "main.css"), "w") as f:
+            f.write("body { color: black; }\n" * 100)
+        api = API(static_dir=directory)
+        yield lambda: request(api, "/static/main.css")
+
+
+# orm
+
+@contextmanager
+def _database(books=0):
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, "bench.db"), pragmas={"synchronous": "OFF"})
+        db.create(Author)
+        db.create(Book)
+        author = Author(name="Frank Herbert", age=65)
+        db.save(author)
+        db.bulk_save([Book(title=f"Book {i}", published=True, author=author) for i in range(books)])
+        try:
+            yield db, author
+        finally:
+            db.close()
+
+
+@benchmark("orm/save", 2000)
+def orm_save():
+    with _database() as (db, author):
+        yield lambda: db.save(Book(title="Dune", published=True, author=author))
+
+
+@benchmark("orm/get", 10000)
+def orm_get():
+    with _database(books=1) as (db, author):
+        yield lambda: db.get(Book, id=1)
+
+
+@benchmark("orm/all-100", 1000)
+def orm_all():
+    with _database(books=100) as (db, author):
+        yield lambda: db.all(Book)
+
+
+@benchmark("orm/bulk-save-1000", 50)
+def orm_bulk_save():
+    with _database() as (db, author):
+        yield lambda: db.bulk_save([Book(title=f"Book {i}", published=True, author=author) for i in range(1000)])
+
+
+def run(pattern=None, scale=1.0):
+    results = {}
+    for name, number, setup in BENCHMARKS:
+        if pattern is not None and pattern not in name:
+            continue
+        with setup() as func:
+            results[name] = measure(func, max(1, int(number * scale)))
+        print_result(name, results[name])
+    return results
+
+
+def metadata():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def print_result(name, result):
+    print(
+        f"{name:<28} {result['ops_per_sec']:>12.0f} ops/s {result['p50_us']:>10.1f} "
+        f"{result['p95_us']:>10.1f} {result['p99_us']:>10.1f}"
+    )
+
+
+def compare(baseline, results, threshold):
+    # a benchmark regresses when its throughput drops by more than threshold
+    print(f"\n{'benchmark':<28} {'baseline':>12} {'current':>12} {'change':>8}")
+    regressions = []
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        change = result["ops_per_sec"] / before["ops_per_sec"] - 1
+        flag = ""
+        if change < -threshold:
+            regressions.append(name)
+            flag = "  regression"
+        print(f"{name:<28} {before['ops_per_sec']:>12.0f} {result['ops_per_sec']:>12.0f} {change:>+7.1%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the bumbov API and ORM through a raw WSGI harness.")
+    parser.add_argument("-k", dest="pattern", help="only run benchmarks whose name contains this string")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the number of iterations")
+    parser.add_argument("--output", help="save the results as JSON")
+    parser.add_argument("--compare", help="compare against results saved with --output")
+    parser.add_argument("--threshold", type=float, default=0.1, help="slowdown reported as a regression (default 0.1)")
+    args = parser.parse_args(argv)
+
+    print(f"{'benchmark':<28} {'throughput':>18} {'p50 (us)':>10} {'p95 (us)':>10} {'p99 (us)':>10}")
+    results = run(args.pattern, args.scale)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"meta": metadata(), "results": results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,39 +1,136 @@
+import asyncio
+import contextvars
+import functools
+import hashlib
 import inspect
 import os
 
-from parse import parse
 from webob import Request
 from requests import Session as RequestSession
 from whitenoise import WhiteNoise
 from wsgiadapter import WSGIAdapter as RequestsWISGIAdapter
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 
-from .middleware import Middleware
+from .asgi import build_environ, call_wsgi, lifespan, read_body, send_wsgi_response
+from .cache import LRUCache, MISSING, cache_response
+from .compression import precompress
+from .metrics import RequestTiming
+from .middleware import Middleware, _run_sync
 from .response import Response
+from .routing import Router
 
 class API:
 
-    def __init__(self, template_dir="templates", static_dir="static"):
+    def __init__(self, template_dir="templates", static_dir="static", route_cache_size=None,
+                 executor=None, json_serializer=None, template_auto_reload=True,
+                 template_cache_dir=None, precompile_templates=False, cache_backend=None,
+                 metrics=None, metrics_path=None, static_max_age=60, precompress_static=False,
+                 static_prefix="/static"):
         self.routes = {}
+        self.router = Router()
+        self.route_cache = LRUCache(route_cache_size) if route_cache_size else None
+        self.cache_backend = cache_backend if cache_backend is not None else LRUCache()
+
+        bytecode_cache = None
+        if template_cache_dir is not None:
+            os.makedirs(template_cache_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(os.path.abspath(template_cache_dir))
 
         self.template_env = Environment(
-            loader=FileSystemLoader(os.path.abspath(template_dir))
+            loader=FileSystemLoader(os.path.abspath(template_dir)),
+            auto_reload=template_auto_reload,
+            bytecode_cache=bytecode_cache,
+            cache_size=-1 if precompile_templates else 400,
         )
+        self.template_env.globals["static_url"] = self.static_url
+        if precompile_templates:
+            self.precompile_templates()
         self.exception_handler = None
-        self.whitenoise = WhiteNoise(self.wsgi_app, root=static_dir)
+        self.static_dir = static_dir
+        self.static_prefix = "/" + static_prefix.strip("/") + "/"
+        self.static_urls = {}
+        self._immutable_static_urls = set()
+        if precompress_static and os.path.isdir(static_dir):
+            # WhiteNoise picks up the .gz/.br files when it scans static_dir
+            precompress(static_dir)
+        # WhiteNoise keeps every static file in memory keyed by its full URL, so
+        # requests are matched without rewriting PATH_INFO or touching the disk
+        self.whitenoise = WhiteNoise(
+            self.wsgi_app, root=static_dir, prefix=self.static_prefix, max_age=static_max_age,
+            immutable_file_test=self._is_immutable_static_file,
+        )
+        self.index_static_files()
+        self.executor = executor
+        self.json_serializer = json_serializer
 
         self.middleware = Middleware(self)
 
+        self.metrics = metrics
+        if metrics is not None and metrics_path is not None:
+            self.add_route(metrics_path, self.metrics_handler, allowed_methods=["get"])
 
-    def __call__(self, environ, start_response):
-        path_info = environ["PATH_INFO"]
 
-        if path_info.startswith("/static"):
-            environ["PATH_INFO"] = path_info[len("/static"):]
+    def __call__(self, environ, start_response):
+        if environ["PATH_INFO"].startswith(self.static_prefix):
             return self.whitenoise(environ, start_response)
-        
+
+        if self.metrics is not None:
+            return self._call_with_metrics(environ, start_response)
         return self.middleware(environ, start_response)
 
+    def _call_with_metrics(self, environ, start_response):
+        timing = environ["bumbov.timing"] = RequestTiming(environ["REQUEST_METHOD"])
+        try:
+            request = Request(environ)
+            response = self.middleware.dispatch(request)
+            timing.mark("middleware")
+            app_iter = response(environ, start_response)
+            timing.mark("serialization")
+        except Exception:
+            self._record_timing(timing, 500)
+            raise
+        self._record_timing(timing, response.status_code)
+        return app_iter
+
+    def _record_timing(self, timing, status):
+        timing.finish(status)
+        self.metrics.record(timing)
+
+
+    async def asgi(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await lifespan(receive, send)
+        assert scope["type"] == "http", f"Unsupported ASGI scope type {scope['type']}"
+
+        environ = build_environ(scope, await read_body(receive))
+
+        if environ["PATH_INFO"].startswith(self.static_prefix):
+            status, headers, app_iter = await self.run_sync(call_wsgi, self.whitenoise, environ)
+        else:
+            timing = None
+            if self.metrics is not None:
+                timing = environ["bumbov.timing"] = RequestTiming(environ["REQUEST_METHOD"])
+            try:
+                request = Request(environ)
+                response = await self.middleware.dispatch_async(request)
+                if timing is not None:
+                    timing.mark("middleware")
+                status, headers, app_iter = call_wsgi(response, environ)
+            except Exception:
+                if timing is not None:
+                    self._record_timing(timing, 500)
+                raise
+            if timing is not None:
+                timing.mark("serialization")
+                self._record_timing(timing, response.status_code)
+
+        await send_wsgi_response(send, status, headers, app_iter, self.run_sync)
+
+    async def run_sync(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, func, *args, **kwargs)
+        return await loop.run_in_executor(self.executor, call)
 
     def wsgi_app(self, environ, start_response):
         request = Request(environ)
@@ -52,7 +149,10 @@ class API:
         assert path not in self.routes, f"Route {path} already exists"
         if allowed_methods is None:
             allowed_methods = ["get", "post", "put", "delete", "head", "options", "patch"]
-        self.routes[path] = {"handler": handler, "allowed_methods": allowed_methods}
+        self.routes[path] = {"handler": handler, "allowed_methods": allowed_methods, "path": path}
+        self.router.add(path, self.routes[path])
+        if self.route_cache is not None:
+            self.route_cache.clear()
     
     def route(self, path, allowed_methods=None):
         assert path not in self.routes, f"Route {path} already exists"
@@ -62,43 +162,104 @@ class API:
             return handler
         return wrapper
 
+    def cache(self, ttl=None, key=None):
+        return cache_response(self.cache_backend, ttl=ttl, key=key)
+
+    def metrics_handler(self, request, response):
+        response.body = self.metrics.render().encode("UTF-8")
+        response.content_type = "text/plain; version=0.0.4; charset=UTF-8"
+
     def default_response(self, response):
         response.status_code = 404
         response.text = "Not Found"
         return response
 
     def find_handler(self, request_path):
-        for path, handler_data in self.routes.items():
-            parse_result = parse(path, request_path)
-            if parse_result is not None:
-                return handler_data, parse_result.named
-        return None, None
+        if self.route_cache is None:
+            return self.router.match(request_path)
+
+        result = self.route_cache.get(request_path)
+        if result is MISSING:
+            # 404s are cached as well, as (None, None)
+            result = self.router.match(request_path)
+            self.route_cache.set(request_path, result)
+        return result
+
+    def get_handler(self, request):
+        handler_data, kwargs = self.find_handler(request.path)
+        timing = request.environ.get("bumbov.timing")
+        if timing is not None:
+            # routes are labelled by their pattern, so metrics stay bounded
+            timing.route = None if handler_data is None else handler_data["path"]
+            timing.mark("routing")
+        if handler_data is None:
+            return None, None
+
+        handler = handler_data["handler"]
+        allowed_methods = handler_data["allowed_methods"]
+        if inspect.isclass(handler):
+            handler = getattr(handler(), request.method.lower(), None)
+            if handler is None:
+                raise AttributeError("Method not allowed", request.method)
+
+        else:
+            if request.method.lower() not in allowed_methods:
+                raise AttributeError("Method not allowed", request.method)
+
+        return handler, kwargs
 
     def handle_request(self, request):
-        response = Response()
+        response = Response(json_serializer=self.json_serializer)
+        timing = request.environ.get("bumbov.timing")
+        if timing is not None:
+            timing.mark("middleware")
         try:
-            handler_data, kwargs = self.find_handler(request.path)
-            if handler_data is not None:
-                handler = handler_data["handler"]
-                allowed_methods = handler_data["allowed_methods"]
-                if inspect.isclass(handler):
-                    handler = getattr(handler(), request.method.lower(), None)
-                    if handler is None:
-                        raise AttributeError("Method not allowed", request.method)
+            handler, kwargs = self.get_handler(request)
+            if handler is not None:
+                # under WSGI async handlers get an event loop of their own, like async hooks
+                result = _run_sync(handler(request, response, **kwargs))
+                if isinstance(result, Response):
+                    response = result
+            else:
+                self.default_response(response)
+        except Exception as e:
+            if self.exception_handler is None:
+                raise e
+            else:
+                request.environ["bumbov.exception"] = e
+                _run_sync(self.exception_handler(request, response, e))
 
-                else:
-                    if request.method.lower() not in allowed_methods:
-                        raise AttributeError("Method not allowed", request.method)
+        if timing is not None:
+            timing.mark("handler")
+        return response
 
-                handler(request, response, **kwargs)
-            else:
+    async def handle_request_async(self, request):
+        response = Response(json_serializer=self.json_serializer)
+        timing = request.environ.get("bumbov.timing")
+        if timing is not None:
+            timing.mark("middleware")
+        try:
+            handler, kwargs = self.get_handler(request)
+            if handler is None:
                 self.default_response(response)
+            else:
+                if inspect.iscoroutinefunction(handler):
+                    result = await handler(request, response, **kwargs)
+                else:
+                    result = await self.run_sync(handler, request, response, **kwargs)
+                if isinstance(result, Response):
+                    response = result
         except Exception as e:
             if self.exception_handler is None:
                 raise e
             else:
-                self.exception_handler(request, response, e)
-        
+                request.environ["bumbov.exception"] = e
+                result = self.exception_handler(request, response, e)
+                if inspect.isawaitable(result):
+                    await result
+
+        if timing is not None:
+            timing.mark("handler")
         return response
 
     def template(self, template_name, context=None):
@@ -107,5 +268,50 @@ class API:
         
         return self.template_env.get_template(template_name).render(**context)
 
+    def template_stream(self, template_name, context=None, buffer_size=16):
+        if context is None:
+            context = {}
+
+        stream = self.template_env.get_template(template_name).stream(**context)
+        stream.enable_buffering(buffer_size)
+        return stream
+
+    def precompile_templates(self):
+        for template_name in self.template_env.list_templates():
+            self.template_env.get_template(template_name)
+
+    def index_static_files(self):
+        # every static file is also served under a name containing a hash of its
+        # content, e.g. css/main.3f2a9c1e7b4d.css, which can be cached forever
+        if not os.path.isdir(self.static_dir):
+            return
+
+        for root, _, filenames in os.walk(self.static_dir):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                if self.whitenoise.is_compressed_variant(path):
+                    continue
+                name = os.path.relpath(path, self.static_dir).replace(os.sep, "/")
+                base, extension = os.path.splitext(name)
+                url = f"{self.static_prefix}{base}.{_file_hash(path)}{extension}"
+                self.static_urls[name] = url
+                self._immutable_static_urls.add(url)
+                self.whitenoise.add_file_to_dictionary(url, path)
+
+    def static_url(self, name):
+        name = name.lstrip("/")
+        return self.static_urls.get(name, self.static_prefix + name)
+
+    def _is_immutable_static_file(self, path, url):
+        return url in self._immutable_static_urls
+
     def add_exception_handler(self, exception_handler):
-        self.exception_handler = exception_handler
\ No newline at end of file
+        self.exception_handler = exception_handler
+
+
+def _file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(functools.partial(f.read, 64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
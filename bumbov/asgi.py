@@ -0,0 +1,109 @@
+import sys
+from io import BytesIO
+
+
+async def read_body(receive):
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+def build_environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+        "asgi.scope": scope,
+    }
+
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+        if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+            key = name
+        else:
+            key = f"HTTP_{name}"
+        if key in environ:
+            value = f"{environ[key]},{value}"
+        environ[key] = value
+
+    # the whole body has been read already, whatever the client announced
+    environ["CONTENT_LENGTH"] = str(len(body))
+    return environ
+
+
+def call_wsgi(app, environ):
+    captured = []
+
+    def start_response(status, headers, exc_info=None):
+        captured[:] = [status, headers]
+
+    app_iter = app(environ, start_response)
+    status, headers = captured
+    return status, headers, app_iter
+
+
+async def send_wsgi_response(send, status, headers, app_iter, run_sync):
+    await send({
+        "type": "http.response.start",
+        "status": int(status.split(" ", 1)[0]),
+        "headers": [
+            (name.lower().encode("latin1"), value.encode("latin1"))
+            for name, value in headers
+        ],
+    })
+    try:
+        async for chunk in _iter_body(app_iter, run_sync):
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+    finally:
+        close = getattr(app_iter, "close", None)
+        if close is not None:
+            await run_sync(close)
+
+
+async def _iter_body(app_iter, run_sync):
+    if isinstance(app_iter, (list, tuple)):
+        for chunk in app_iter:
+            yield chunk
+    elif hasattr(app_iter, "__aiter__"):
+        async for chunk in app_iter:
+            yield chunk
+    else:
+        # streamed bodies may block (files, database cursors), so they are
+        # advanced in the thread pool one chunk at a time
+        iterator = iter(app_iter)
+        while True:
+            chunk = await run_sync(next, iterator, None)
+            if chunk is None:
+                break
+            yield chunk
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
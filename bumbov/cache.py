@@ -0,0 +1,178 @@
+import hashlib
+import inspect
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+from .response import Response
+
+
+MISSING = object()
+CACHEABLE_METHODS = ("GET", "HEAD")
+
+
+class CacheBackend:
+
+    def get(self, key, default=MISSING):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LRUCache(CacheBackend):
+
+    def __init__(self, maxsize=1024, ttl=None):
+        assert maxsize > 0, "maxsize must be a positive number"
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            try:
+                expires_at, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    @property
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
+
+
+def cache_response(backend, ttl=None, key=None):
+
+    def decorator(handler):
+        def lookup(request, response):
+            if request.method not in CACHEABLE_METHODS:
+                return None, False
+            cache_control = request.cache_control
+            if cache_control.no_store:
+                return None, False
+
+            cache_key = key(request) if key is not None else request.path_qs
+            if not cache_control.no_cache:
+                entry = backend.get(cache_key)
+                if entry is not MISSING:
+                    _apply_entry(request, response, entry)
+                    return cache_key, True
+            return cache_key, False
+
+        def store(cache_key, request, response):
+            if cache_key is None:
+                return
+            response.set_body_and_content_type()
+            if response.status_code != 200 or not isinstance(response.body, bytes):
+                return
+
+            response_cache_control = response.headers.get("Cache-Control", "")
+            if "no-store" in response_cache_control or "private" in response_cache_control:
+                return
+
+            entry_ttl = _max_age(response_cache_control)
+            if entry_ttl is None:
+                entry_ttl = ttl
+
+            response.headers.setdefault("ETag", f'"{hashlib.sha1(response.body).hexdigest()}"')
+            entry = (response.status_code, response.content_type, response.body, list(response.headers.items()))
+            backend.set(cache_key, entry, ttl=entry_ttl)
+            _not_modified(request, response)
+
+        if inspect.iscoroutinefunction(handler):
+            @wraps(handler)
+            async def wrapper(*args, **kwargs):
+                request, response = args[-2:]
+                cache_key, hit = lookup(request, response)
+                if hit:
+                    return None
+                result = await handler(*args, **kwargs)
+                store(cache_key, request, result if isinstance(result, Response) else response)
+                return result
+        else:
+            @wraps(handler)
+            def wrapper(*args, **kwargs):
+                request, response = args[-2:]
+                cache_key, hit = lookup(request, response)
+                if hit:
+                    return None
+                result = handler(*args, **kwargs)
+                store(cache_key, request, result if isinstance(result, Response) else response)
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def _apply_entry(request, response, entry):
+    status_code, content_type, body, headers = entry
+    response.status_code = status_code
+    response.content_type = content_type
+    response.body = body
+    response.headers.extend(headers)
+    _not_modified(request, response)
+
+
+def _not_modified(request, response):
+    if response.headers["ETag"].strip('"') in request.if_none_match:
+        response.status_code = 304
+        response.body = b""
+        response.text = response.html = response.json = None
+
+
+def _max_age(cache_control):
+    for directive in cache_control.split(","):
+        name, _, value = directive.strip().partition("=")
+        if name == "max-age" and value.isdigit():
+            return int(value)
+    return None
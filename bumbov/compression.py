@@ -0,0 +1,200 @@
+import argparse
+import gzip
+import os
+import sys
+import zlib
+from functools import partial
+
+from webob.etag import ETagMatcher
+from whitenoise.compress import Compressor
+
+from .middleware import Middleware
+from .response import _aiter_chunks, _iter_chunks, _iter_file
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSIBLE_CONTENT_TYPES = (
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+
+
+class CompressionMiddleware(Middleware):
+    def __init__(self, app, minimum_size=500, content_types=COMPRESSIBLE_CONTENT_TYPES,
+                 gzip_level=6, brotli_quality=4):
+        super().__init__(app)
+        self.minimum_size = minimum_size
+        self.content_types = tuple(content_types)
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.encodings = ["br", "gzip"] if brotli is not None else ["gzip"]
+
+    def process_request(self, request):
+        # the compressed body gets its own ETag, so conditional requests are answered here once the
+        # final ETag is known instead of by inner layers that only see the uncompressed one
+        if "HTTP_IF_NONE_MATCH" in request.environ and self._offers(request):
+            request.environ["bumbov.if_none_match"] = request.environ.pop("HTTP_IF_NONE_MATCH")
+
+    def process_response(self, request, response):
+        if_none_match = request.environ.pop("bumbov.if_none_match", None)
+        if if_none_match is not None:
+            request.environ["HTTP_IF_NONE_MATCH"] = if_none_match
+        encoding = self._encoding(request, response)
+
+        etag = response.headers.get("ETag")
+        if etag is not None and encoding is not None:
+            etag = response.headers["ETag"] = _encoded_etag(etag, encoding)
+        if etag is not None and if_none_match is not None and response.status_code == 200:
+            if _etag_value(etag) in ETagMatcher.parse(if_none_match):
+                _not_modified(response)
+                if encoding is not None:
+                    _vary(response)
+                return
+        if encoding is None:
+            return
+
+        body = response.body
+        if isinstance(body, bytes):
+            response.body = self.compress(encoding, body)
+        elif hasattr(body, "__aiter__"):
+            response.body = self._compress_async_stream(encoding, _aiter_chunks(body))
+        else:
+            chunks = _iter_file(body) if hasattr(body, "read") else _iter_chunks(body)
+            response.body = self._compress_stream(encoding, chunks)
+
+        # the body is final now, so Response.__call__ must not rebuild it
+        response.text = response.html = response.json = response.ndjson = None
+        response.headers.pop("Content-Length", None)
+        response.headers["Content-Encoding"] = encoding
+        _vary(response)
+
+    def _offers(self, request):
+        # no Accept-Encoding header at all means the client did not ask for compression
+        if not request.accept_encoding:
+            return []
+        return request.accept_encoding.acceptable_offers(self.encodings)
+
+    def _encoding(self, request, response):
+        if "Content-Encoding" in response.headers or response.status_code in (204, 304):
+            return None
+        offers = self._offers(request)
+        if not offers:
+            return None
+
+        response.set_body_and_content_type()
+        content_type = response.headers.get("Content-Type") or response.content_type or "text/html"
+        if not content_type.split(";", 1)[0].strip().startswith(self.content_types):
+            return None
+        body = response.body
+        if isinstance(body, bytes) and len(body) < self.minimum_size:
+            return None
+        return offers[0][0]
+
+    def compress(self, encoding, body):
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, self.gzip_level, mtime=0)
+
+    def _compressor(self, encoding):
+        # every chunk is flushed, so streamed responses still reach the client as they are produced
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=self.brotli_quality)
+            return compressor.process, compressor.flush, compressor.finish
+        compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress, partial(compressor.flush, zlib.Z_SYNC_FLUSH), compressor.flush
+
+    def _compress_stream(self, encoding, chunks):
+        compress, flush, finish = self._compressor(encoding)
+        try:
+            for chunk in chunks:
+                data = compress(chunk) + flush()
+                if data:
+                    yield data
+            yield finish()
+        finally:
+            chunks.close()
+
+    async def _compress_async_stream(self, encoding, chunks):
+        compress, flush, finish = self._compressor(encoding)
+        async for chunk in chunks:
+            data = compress(chunk) + flush()
+            if data:
+                yield data
+        yield finish()
+
+
+def _encoded_etag(etag, encoding):
+    # "abc" becomes "abc-gzip", so a cached identity body is never revalidated as the compressed one
+    if etag.endswith('"'):
+        return f'{etag[:-1]}-{encoding}"'
+    return f"{etag}-{encoding}"
+
+
+def _etag_value(etag):
+    if etag.startswith("W/"):
+        etag = etag[2:]
+    return etag.strip('"')
+
+
+def _vary(response):
+    vary = response.headers.get("Vary")
+    if vary is None:
+        response.headers["Vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower():
+        response.headers["Vary"] = f"{vary}, Accept-Encoding"
+
+
+def _not_modified(response):
+    close = getattr(response.body, "close", None)
+    if close is not None:
+        close()
+    response.status_code = 304
+    response.body = b""
+    response.text = response.html = response.json = response.ndjson = None
+    response.headers.pop("Content-Length", None)
+
+
+def precompress(directory, minimum_size=500, use_brotli=True, quiet=True):
+    # writes .gz (and .br when brotli is installed) next to every static file, which
+    # WhiteNoise then serves to clients that accept them. Up to date files are skipped.
+    compressor = Compressor(use_brotli=use_brotli, quiet=quiet)
+    suffixes = [".gz"] + ([".br"] if compressor.use_brotli else [])
+    written = []
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            if not compressor.should_compress(filename) or os.path.getsize(path) < minimum_size:
+                continue
+            mtime = os.path.getmtime(path)
+            if all(_has_mtime(path + suffix, mtime) for suffix in suffixes):
+                continue
+            written.extend(compressor.compress(path))
+    return written
+
+
+def _has_mtime(path, mtime):
+    return os.path.exists(path) and os.path.getmtime(path) == mtime
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write .gz and .br versions of the files in a static directory.")
+    parser.add_argument("directory", help="the static directory, e.g. static/")
+    parser.add_argument("--minimum-size", type=int, default=500, help="skip files smaller than this many bytes")
+    parser.add_argument("--no-brotli", action="store_false", dest="use_brotli", help="only write .gz files")
+    parser.add_argument("-q", "--quiet", action="store_true", help="do not list the compressed files")
+    args = parser.parse_args(argv)
+
+    precompress(args.directory, args.minimum_size, args.use_brotli, args.quiet)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
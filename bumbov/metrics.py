@@ -0,0 +1,190 @@
+from collections import deque
+from threading import Lock
+from time import perf_counter
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"))
+
+
+class RequestTiming:
+    __slots__ = ("method", "route", "status", "duration", "phases", "queries", "started", "_last")
+
+    def __init__(self, method):
+        # methods are sent by the client, so unknown ones share a label to keep series bounded
+        self.method = method if method in METHODS else "OTHER"
+        self.route = None
+        self.status = None
+        self.duration = None
+        self.phases = {}
+        self.queries = None
+        self.started = self._last = perf_counter()
+
+    def mark(self, phase):
+        # the time since the previous mark is added to the given phase
+        now = perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def finish(self, status):
+        self.status = status
+        self.duration = perf_counter() - self.started
+
+
+class MetricsSink:
+    def record(self, timing):
+        raise NotImplementedError
+
+
+class _RouteStats:
+    __slots__ = ("buckets", "count", "sum", "samples", "statuses", "phases", "queries", "query_seconds")
+
+    def __init__(self, bucket_count, sample_size):
+        self.buckets = [0] * bucket_count
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=sample_size)
+        self.statuses = {}
+        self.phases = {}
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    def copy(self):
+        copy = _RouteStats(0, None)
+        copy.buckets = list(self.buckets)
+        copy.count = self.count
+        copy.sum = self.sum
+        # samples are sorted once here so percentiles can index into them
+        copy.samples = sorted(self.samples)
+        copy.statuses = dict(self.statuses)
+        copy.phases = dict(self.phases)
+        copy.queries = self.queries
+        copy.query_seconds = self.query_seconds
+        return copy
+
+
+class Metrics(MetricsSink):
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, sample_size=1024):
+        self.buckets = tuple(sorted(buckets))
+        self.sample_size = sample_size
+        self._routes = {}
+        self._lock = Lock()
+
+    def record(self, timing):
+        key = (timing.method, timing.route)
+        with self._lock:
+            stats = self._routes.get(key)
+            if stats is None:
+                stats = self._routes[key] = _RouteStats(len(self.buckets), self.sample_size)
+
+            duration = timing.duration
+            stats.count += 1
+            stats.sum += duration
+            # percentiles are computed from the most recent sample_size requests
+            stats.samples.append(duration)
+            for index, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    stats.buckets[index] += 1
+                    break
+            stats.statuses[timing.status] = stats.statuses.get(timing.status, 0) + 1
+            for phase, seconds in timing.phases.items():
+                stats.phases[phase] = stats.phases.get(phase, 0.0) + seconds
+            if timing.queries is not None:
+                stats.queries += timing.queries["count"]
+                stats.query_seconds += timing.queries["duration"]
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+    def summary(self):
+        summary = {}
+        for key, stats in self._snapshot():
+            summary[key] = {
+                "count": stats.count,
+                "sum": stats.sum,
+                "p50": _percentile(stats.samples, 0.5),
+                "p95": _percentile(stats.samples, 0.95),
+                "p99": _percentile(stats.samples, 0.99),
+                "statuses": stats.statuses,
+                "phases": stats.phases,
+                "queries": stats.queries,
+                "query_seconds": stats.query_seconds,
+            }
+        return summary
+
+    def render(self):
+        routes = [(_labels(method, route), stats) for (method, route), stats in self._snapshot()]
+
+        lines = [
+            "# HELP bumbov_requests_total Requests handled, by route and status code.",
+            "# TYPE bumbov_requests_total counter",
+        ]
+        for labels, stats in routes:
+            for status, count in sorted(stats.statuses.items()):
+                lines.append(f'bumbov_requests_total{{{labels},status="{status}"}} {count}')
+
+        lines += [
+            "# HELP bumbov_request_duration_seconds Request latency, by route.",
+            "# TYPE bumbov_request_duration_seconds histogram",
+        ]
+        for labels, stats in routes:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, stats.buckets):
+                cumulative += bucket
+                lines.append(f'bumbov_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'bumbov_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.count}')
+            lines.append(f"bumbov_request_duration_seconds_sum{{{labels}}} {stats.sum}")
+            lines.append(f"bumbov_request_duration_seconds_count{{{labels}}} {stats.count}")
+
+        lines += [
+            "# HELP bumbov_request_latency_seconds Latency percentiles over recent requests, by route.",
+            "# TYPE bumbov_request_latency_seconds summary",
+        ]
+        for labels, stats in routes:
+            for quantile in QUANTILES:
+                lines.append(f'bumbov_request_latency_seconds{{{labels},quantile="{quantile}"}} {_percentile(stats.samples, quantile)}')
+            lines.append(f"bumbov_request_latency_seconds_sum{{{labels}}} {stats.sum}")
+            lines.append(f"bumbov_request_latency_seconds_count{{{labels}}} {stats.count}")
+
+        lines += [
+            "# HELP bumbov_request_phase_seconds_total Time spent in each phase of a request, by route.",
+            "# TYPE bumbov_request_phase_seconds_total counter",
+        ]
+        for labels, stats in routes:
+            for phase, seconds in sorted(stats.phases.items()):
+                lines.append(f'bumbov_request_phase_seconds_total{{{labels},phase="{phase}"}} {seconds}')
+
+        lines += [
+            "# HELP bumbov_request_queries_total Database queries run while handling requests, by route.",
+            "# TYPE bumbov_request_queries_total counter",
+        ]
+        for labels, stats in routes:
+            lines.append(f"bumbov_request_queries_total{{{labels}}} {stats.queries}")
+
+        lines += [
+            "# HELP bumbov_request_query_seconds_total Time spent in database queries, by route.",
+            "# TYPE bumbov_request_query_seconds_total counter",
+        ]
+        for labels, stats in routes:
+            lines.append(f"bumbov_request_query_seconds_total{{{labels}}} {stats.query_seconds}")
+
+        return "\n".join(lines) + "\n"
+
+    def _snapshot(self):
+        with self._lock:
+            routes = [(key, stats.copy()) for key, stats in self._routes.items()]
+        return sorted(routes, key=lambda item: (item[0][1] or "", item[0][0]))
+
+
+def _percentile(samples, quantile):
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(quantile * len(samples)))]
+
+
+def _labels(method, route):
+    route = "unmatched" if route is None else route.replace("\\", "\\\\").replace('"', '\\"')
+    return f'method="{method}",route="{route}"'
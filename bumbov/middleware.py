@@ -1,3 +1,5 @@
+import asyncio
+import inspect
 
 from webob import Request
 
@@ -5,14 +7,16 @@ from webob import Request
 class Middleware:
     def __init__(self, app):
         self.app = app
+        self._pipeline = None
 
     def __call__(self, environ, start_response):
         request = Request(environ)
-        response = self.app.handle_request(request)
+        response = self.dispatch(request)
         return response(environ, start_response)
 
     def add(self, middleware_cls):
         self.app = middleware_cls(self.app)
+        self._pipeline = None
 
     def process_request(self, request):
         pass
@@ -20,8 +24,136 @@ class Middleware:
     def process_response(self, request, response):
         pass
 
+    def process_exception(self, request, exception):
+        pass
+
     def handle_request(self, request):
         self.process_request(request)
         response = self.app.handle_request(request)
         self.process_response(request, response)
-        return response
\ No newline at end of file
+        return response
+
+    async def handle_request_async(self, request):
+        if not _is_default(self, "handle_request"):
+            return await _handle_request_async(self, request)
+        result = self.process_request(request)
+        if inspect.isawaitable(result):
+            await result
+        response = await self.app.handle_request_async(request)
+        result = self.process_response(request, response)
+        if inspect.isawaitable(result):
+            await result
+        return response
+
+    @property
+    def pipeline(self):
+        if getattr(self, "_pipeline", None) is None:
+            self._pipeline = self._build_pipeline()
+        return self._pipeline
+
+    def _build_pipeline(self):
+        # Walk the chain of wrapped middlewares once and keep only the hooks that
+        # are actually overridden, outermost first. A middleware that overrides
+        # handle_request itself is kept as the endpoint so it still wraps the rest.
+        # process_exception hooks run when anything after their process_request raises.
+        layers = []
+        endpoint = self.app
+        while isinstance(endpoint, Middleware) and _is_default(endpoint, "handle_request"):
+            hooks = tuple(
+                None if _is_default(endpoint, name) else getattr(endpoint, name)
+                for name in ("process_request", "process_response", "process_exception")
+            )
+            if any(hook is not None for hook in hooks):
+                layers.append(hooks)
+            endpoint = endpoint.app
+        return tuple(layers), endpoint
+
+    def dispatch(self, request):
+        # pending counts the outermost layers whose process_request has run and
+        # whose process_response has not finished; they get process_exception
+        # whenever anything in the pipeline raises, including their own
+        # process_response, so they can always clean up
+        layers, endpoint = self.pipeline
+        response = None
+        pending = 0
+        try:
+            for process_request, _, _ in layers:
+                if process_request is not None:
+                    response = _run_sync(process_request(request))
+                pending += 1
+                if response is not None:
+                    break
+
+            if response is None:
+                response = endpoint.handle_request(request)
+
+            while pending:
+                process_response = layers[pending - 1][1]
+                if process_response is not None:
+                    _run_sync(process_response(request, response))
+                pending -= 1
+        except Exception as e:
+            for _, _, process_exception in reversed(layers[:pending]):
+                if process_exception is not None:
+                    _run_sync(process_exception(request, e))
+            raise
+        return response
+
+    async def dispatch_async(self, request):
+        layers, endpoint = self.pipeline
+        response = None
+        pending = 0
+        try:
+            for process_request, _, _ in layers:
+                if process_request is not None:
+                    response = process_request(request)
+                    if inspect.isawaitable(response):
+                        response = await response
+                pending += 1
+                if response is not None:
+                    break
+
+            if response is None:
+                response = await _handle_request_async(endpoint, request)
+
+            while pending:
+                process_response = layers[pending - 1][1]
+                if process_response is not None:
+                    result = process_response(request, response)
+                    if inspect.isawaitable(result):
+                        await result
+                pending -= 1
+        except Exception as e:
+            for _, _, process_exception in reversed(layers[:pending]):
+                if process_exception is not None:
+                    result = process_exception(request, e)
+                    if inspect.isawaitable(result):
+                        await result
+            raise
+        return response
+
+
+def _is_default(middleware, name):
+    return getattr(type(middleware), name) is getattr(Middleware, name)
+
+
+async def _handle_request_async(endpoint, request):
+    if not isinstance(endpoint, Middleware) or not _is_default(endpoint, "handle_request_async"):
+        return await endpoint.handle_request_async(request)
+
+    # the endpoint only overrides handle_request, which must still wrap the rest
+    # of the chain under ASGI: async overrides are awaited, sync ones run in the
+    # API's executor like sync handlers do
+    if inspect.iscoroutinefunction(endpoint.handle_request):
+        return await endpoint.handle_request(request)
+    app = endpoint.app
+    while isinstance(app, Middleware):
+        app = app.app
+    return await app.run_sync(endpoint.handle_request, request)
+
+
+def _run_sync(result):
+    # async hooks only get an event loop of their own when running under WSGI
+    if inspect.isawaitable(result):
+        return asyncio.run(result)
+    return result
@@ -1,196 +1,639 @@
-import sqlite3
+import asyncio
 import inspect
+import logging
+import queue
+import sqlite3
+import threading
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+from itertools import groupby
+from time import perf_counter
+
+from .cache import LRUCache, MISSING
+from .middleware import Middleware
+
+
+MAX_QUERY_PARAMETERS = 900
+
+logger = logging.getLogger(__name__)
+
+QueryRecord = namedtuple("QueryRecord", "sql params duration rows")
+
+
+class ConnectionPool:
+
+    def __init__(self, connect, size=5, timeout=30):
+        assert size > 0, "Connection pool size must be a positive number"
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return self.connect()
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise Exception(f"No database connection available after {self.timeout} seconds")
+
+    def checkin(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+class QueryProfile:
+
+    def __init__(self, n_plus_one_threshold):
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.queries = []
+
+    @property
+    def duration(self):
+        return sum(query.duration for query in self.queries)
+
+    @property
+    def n_plus_one(self):
+        # the ORM sends parameterized SQL, so a statement repeated with different
+        # parameters shows up as the same text
+        counts = Counter(query.sql for query in self.queries if query.sql.startswith("SELECT"))
+        return [(sql, count) for sql, count in counts.items() if count >= self.n_plus_one_threshold]
+
+    def summary(self):
+        return {
+            "count": len(self.queries),
+            "duration": self.duration,
+            "rows": sum(query.rows for query in self.queries),
+            "n_plus_one": self.n_plus_one,
+        }
+
+
+class QueryProfiler:
+
+    def __init__(self, slow_query_threshold=None, n_plus_one_threshold=5):
+        self.slow_query_threshold = slow_query_threshold
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.count = 0
+        self.duration = 0.0
+        # every active profile, outermost first; a query is recorded in all of them
+        self._current = ContextVar(f"bumbov_query_profile_{id(self)}", default=())
+
+    def record(self, sql, params, duration, rows):
+        query = QueryRecord(sql, len(params), duration, rows)
+        self.count += 1
+        self.duration += duration
+        if self.slow_query_threshold is not None and duration >= self.slow_query_threshold:
+            logger.warning("Slow query (%.1f ms, %d rows): %s", duration * 1000, rows, sql)
+
+        for profile in self._current.get():
+            profile.queries.append(query)
+        return query
+
+    def start(self):
+        # the token restores the profiles that were active before, so profiles can nest
+        profile = QueryProfile(self.n_plus_one_threshold)
+        return self._current.set(self._current.get() + (profile,))
+
+    def stop(self, token):
+        profile = self._current.get()[-1]
+        self._current.reset(token)
+        for sql, count in profile.n_plus_one:
+            logger.warning("Possible N+1 query, executed %d times: %s", count, sql)
+        return profile
+
+    @contextmanager
+    def profile(self):
+        token = self.start()
+        try:
+            yield self._current.get()[-1]
+        finally:
+            self.stop(token)
 
 
 class Database:
 
-    def __init__(self, path) -> None:
-        self.conn = sqlite3.Connection(path)
+    def __init__(self, path, pool_size=5, pool_timeout=30, wal=False, pragmas=None, lazy=False,
+                 cache_size=None, cache_ttl=None, identity_map=False, profiler=None) -> None:
+        in_memory = path == ":memory:"
+        if in_memory:
+            # every connection to ":memory:" would be a separate database
+            path = f"file:bumbov-{id(self)}?mode=memory&cache=shared"
+        self.path = path
+        self.lazy = lazy
+        self.pragmas = dict(pragmas or {})
+        if wal:
+            self.pragmas.setdefault("journal_mode", "WAL")
+
+        self.pool = ConnectionPool(self._connect, size=pool_size, timeout=pool_timeout)
+        self._local = threading.local()
+        self._bound = ContextVar(f"bumbov_database_{id(self)}", default=None)
+        self._transactions = {}
+        # rows fetched by get() are kept by (table, id), identity maps hold instances
+        self.cache = LRUCache(cache_size, ttl=cache_ttl) if cache_size else None
+        self.use_identity_map = identity_map
+        self._identity_map = ContextVar(f"bumbov_identity_map_{id(self)}", default=None)
+        self.profiler = profiler
+        self._keepalive = self._connect() if in_memory else None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, uri=self.path.startswith("file:"), check_same_thread=False)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    @property
+    def conn(self):
+        conn = self._bound.get()
+        if conn is not None:
+            return conn
+
+        # outside of a connection scope every thread gets its own connection
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def acquire(self):
+        conn = self._bound.get()
+        if conn is None:
+            conn = self.pool.checkout()
+            self._bound.set(conn)
+        return conn
+
+    async def acquire_async(self):
+        # waiting for a free connection can take up to pool_timeout, so it
+        # happens in a thread instead of on the event loop
+        conn = self._bound.get()
+        if conn is None:
+            conn = await asyncio.get_running_loop().run_in_executor(None, self.pool.checkout)
+            self._bound.set(conn)
+        return conn
+
+    def release(self):
+        conn = self._bound.get()
+        if conn is not None:
+            self._bound.set(None)
+            self._transactions.pop(conn, None)
+            self.pool.checkin(conn)
+
+    @contextmanager
+    def connection(self):
+        if self._bound.get() is not None:
+            yield self._bound.get()
+            return
+
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release()
+
+    @contextmanager
+    def identity_map(self):
+        if self._identity_map.get() is not None:
+            yield self._identity_map.get()
+            return
+
+        token = self._identity_map.set({})
+        try:
+            yield self._identity_map.get()
+        finally:
+            self._identity_map.reset(token)
+
+    def _invalidate(self, table, ids):
+        identity_map = self._identity_map.get()
+        for id in ids:
+            key = _row_key(table, id)
+            if self.cache is not None:
+                self.cache.delete(key)
+            if identity_map is not None:
+                identity_map.pop(key, None)
+
+    @property
+    def middleware(self):
+        return partial(DatabaseMiddleware, database=self)
+
+    @property
+    def transaction_middleware(self):
+        return partial(TransactionMiddleware, database=self)
+
+    def close(self):
+        self.pool.close()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def execute(self, sql, params=(), conn=None):
+        if conn is None:
+            conn = self.conn
+        if self.profiler is None:
+            return conn.execute(sql, params)
+
+        start = perf_counter()
+        cursor = conn.execute(sql, params)
+        self.profiler.record(sql, params, perf_counter() - start, max(cursor.rowcount, 0))
+        return cursor
+
+    def executemany(self, sql, seq_of_params, conn=None):
+        if conn is None:
+            conn = self.conn
+        if self.profiler is None:
+            return conn.executemany(sql, seq_of_params)
+
+        seq_of_params = list(seq_of_params)
+        start = perf_counter()
+        cursor = conn.executemany(sql, seq_of_params)
+        params = [param for params in seq_of_params for param in params]
+        self.profiler.record(sql, params, perf_counter() - start, max(cursor.rowcount, 0))
+        return cursor
+
+    def fetchall(self, sql, params=()):
+        if self.profiler is None:
+            return self.conn.execute(sql, params).fetchall()
+
+        start = perf_counter()
+        rows = self.conn.execute(sql, params).fetchall()
+        self.profiler.record(sql, params, perf_counter() - start, len(rows))
+        return rows
+
+    def fetchone(self, sql, params=()):
+        if self.profiler is None:
+            return self.conn.execute(sql, params).fetchone()
+
+        start = perf_counter()
+        row = self.conn.execute(sql, params).fetchone()
+        self.profiler.record(sql, params, perf_counter() - start, 0 if row is None else 1)
+        return row
 
     @property
     def tables(self):
         SELECT_TABLES_SQL = "SELECT name FROM sqlite_master WHERE type='table'"
-        return [row[0] for row in self.conn.execute(SELECT_TABLES_SQL).fetchall()]
+        return [row[0] for row in self.fetchall(SELECT_TABLES_SQL)]
 
     def create(self, table):
-        self.conn.execute(table._get_create_sql())
+        self.execute(table._get_create_sql())
+        for sql in table._get_create_index_sqls():
+            self.execute(sql)
+
+    def explain(self, query, params=()):
+        if isinstance(query, Query):
+            query, _, params = query._compile("select")
+        rows = self.conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+        return [row[-1] for row in rows]
 
     def save(self, instance):
         sql, values = instance._get_insert_sql()
-        cursor = self.conn.execute(sql, values)
-        instance._data["id"] = cursor.lastrowid
-        self.conn.commit()
+        cursor = self.execute(sql, values)
+        instance.id = cursor.lastrowid
+        self._commit()
+        self._invalidate(type(instance), [instance.id])
 
-    def all(self, table):
+    def all(self, table, lazy=None):
         sql, fields = table._get_select_all_sql()
-        rows = self.conn.execute(sql).fetchall()
-        result = []
-        for row in rows:
-            instance = table()
-            for field, value in zip(fields, row):
-                if field.endswith("_id"):
-                    field = field[:-3]
-                    fk = getattr(table, field)
-                    value = self.get(fk.table, id=value)
-                setattr(instance, field, value)
-            result.append(instance)
-        
-        return result
-
-    def get(self, table, id):
+        rows = self.fetchall(sql)
+        return self._build_instances(table, fields, rows, {}, lazy)
+
+    def get(self, table, id, lazy=None):
+        key = _row_key(table, id)
+        identity_map = self._identity_map.get()
+        if identity_map is None:
+            identity_map = {}
+        elif key in identity_map:
+            return identity_map[key]
+
+        # the cache holds rows rather than instances, so callers never share
+        # mutable objects outside of an identity map scope. Inside a transaction
+        # rows may not be committed yet, so other threads must not see them.
         sql, fields, params = table._get_select_where_sql(id)
-        row = self.conn.execute(sql, params).fetchone()
-        if row is None:
-            raise Exception(f"{table.__name__} instance with id {id} does not exist")
-
-        instance = table()
-        for field, value in zip(fields, row):
-            if field.endswith("_id"):
-                field = field[:-3]
-                fk = getattr(table, field)
-                value = self.get(fk.table, id=value)
-            setattr(instance, field, value)
-        
-        return instance
+        cache = None if self._in_transaction() else self.cache
+        row = MISSING if cache is None else cache.get(key)
+        if row is MISSING:
+            row = self.fetchone(sql, params)
+            if row is None:
+                raise Exception(f"{table.__name__} instance with id {id} does not exist")
+            if cache is not None:
+                cache.set(key, row)
+
+        return self._build_instances(table, fields, [row], identity_map, lazy)[0]
+
+    def query(self, table):
+        return Query(self, table)
+
+    def iterate(self, table, chunk_size=500, limit=None, offset=None, after=None, lazy=None):
+        query = self.query(table).order_by("id").limit(limit).offset(offset)
+        if after is not None:
+            query = query.filter(id__gt=after)
+        return query.iterator(chunk_size=chunk_size, lazy=lazy)
+
+    def _iterate_rows(self, table, sql, fields, params, chunk_size, lazy):
+        # a streamed query is recorded once, with the time spent fetching its chunks
+        start = perf_counter()
+        cursor = self.conn.execute(sql, params)
+        duration = perf_counter() - start
+        count = 0
+        try:
+            while True:
+                start = perf_counter()
+                rows = cursor.fetchmany(chunk_size)
+                duration += perf_counter() - start
+                if not rows:
+                    break
+                count += len(rows)
+                # related rows are shared within a chunk only, so memory stays bounded
+                yield from self._build_instances(table, fields, rows, {}, lazy)
+        finally:
+            cursor.close()
+            if self.profiler is not None:
+                self.profiler.record(sql, params, duration, count)
+
+    def _build_instances(self, table, fields, rows, identity_map, lazy):
+        if lazy is None:
+            lazy = self.lazy
+
+        foreign_keys = []
+        for index, field in enumerate(fields):
+            fk = getattr(table, field[:-3], None) if field.endswith("_id") else None
+            if isinstance(fk, ForeignKey):
+                foreign_keys.append((index, field[:-3], fk.table))
+
+        # rows are written straight into the instance slots, skipping __init__
+        slots = [table._slots[field] for field in fields]
+        new = table.__new__
+        instances = []
+        for row in rows:
+            instance = new(table)
+            for slot, value in zip(slots, row):
+                slot.__set__(instance, value)
+            identity_map[(table, instance.id)] = instance
+            instances.append(instance)
+
+        # every related table is loaded with one query per batch of ids, and each
+        # related row becomes a single instance shared by all rows pointing at it
+        for index, field, fk_table in foreign_keys:
+            ids = {row[index] for row in rows if row[index] is not None}
+            if lazy:
+                related = {id: LazyReference(self, fk_table, id) for id in ids}
+            else:
+                related = self._load_by_ids(fk_table, ids, identity_map)
+            slot = table._slots[fields[index]]
+            for instance, row in zip(instances, rows):
+                id = row[index]
+                slot.__set__(instance, None if id is None else related[id])
+
+        return instances
+
+    def _load_by_ids(self, table, ids, identity_map):
+        missing = [id for id in ids if (table, id) not in identity_map]
+        for start in range(0, len(missing), MAX_QUERY_PARAMETERS):
+            sql, fields, params = table._get_select_in_sql(missing[start:start + MAX_QUERY_PARAMETERS])
+            rows = self.fetchall(sql, params)
+            self._build_instances(table, fields, rows, identity_map, lazy=False)
+
+        related = {}
+        for id in ids:
+            instance = identity_map.get((table, id))
+            if instance is None:
+                raise Exception(f"{table.__name__} instance with id {id} does not exist")
+            related[id] = instance
+        return related
 
     
     def update(self, instance):
         sql, values = instance._get_update_sql()
-        self.conn.execute(sql, values)
-        self.conn.commit()
+        self.execute(sql, values)
+        self._commit()
+        self._invalidate(type(instance), [instance.id])
 
     def delete(self, instance, id):
         sql, params = instance._get_delete_sql(id)
-        self.conn.execute(sql, params)
-        self.conn.commit()
+        self.execute(sql, params)
+        self._commit()
+        # delete() takes either the model class or one of its instances
+        self._invalidate(instance if isinstance(instance, type) else type(instance), [id])
 
 
-class Table:
+    def bulk_save(self, instances, batch_size=1000):
+        with self.transaction() as conn:
+            for table, batch in _batches(instances, batch_size):
+                values = [instance._get_values() for instance in batch]
+                self.executemany(table._insert_sql, values, conn)
+                # rows inserted by one statement inside a write transaction get consecutive ids
+                last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+                for offset, instance in enumerate(reversed(batch)):
+                    instance.id = last_id - offset
+                self._invalidate(table, [instance.id for instance in batch])
 
-    def __init__(self, **kwargs):
-        self._data = {
-            "id": None
-        }
+    def bulk_update(self, instances, batch_size=1000):
+        with self.transaction() as conn:
+            for table, batch in _batches(instances, batch_size):
+                self.executemany(table._update_sql, [instance._get_update_sql()[1] for instance in batch], conn)
+                self._invalidate(table, [instance.id for instance in batch])
 
-        for key, value in kwargs.items():
-            self._data[key] = value
+    def bulk_delete(self, table, ids, batch_size=1000):
+        ids = [id.id if isinstance(id, Table) else id for id in ids]
+        with self.transaction() as conn:
+            for start in range(0, len(ids), batch_size):
+                self.executemany(table._delete_sql, [[id] for id in ids[start:start + batch_size]], conn)
+        self._invalidate(table, ids)
 
-    def __getattribute__(self, key):
-        _data = super().__getattribute__("_data")
-        if key in _data:
-            return _data[key]
-        return super().__getattribute__(key)
+    def begin(self):
+        conn = self.conn
+        depth = self._transactions.get(conn, 0)
+        conn.execute("BEGIN" if depth == 0 else f"SAVEPOINT bumbov_{depth}")
+        self._transactions[conn] = depth + 1
 
-    def __setattr__(self, key, value):
-        super().__setattr__(key, value)
-        if key in self._data:
-            self._data[key] = value
+    def commit(self):
+        conn = self.conn
+        depth = self._transactions.get(conn, 1) - 1
+        if depth == 0:
+            self._transactions.pop(conn, None)
+            conn.commit()
+        else:
+            self._transactions[conn] = depth
+            conn.execute(f"RELEASE SAVEPOINT bumbov_{depth}")
 
-    @classmethod
-    def _get_create_sql(cls):
-        CREATE_TABLE_SQL = "CREATE TABLE IF NOT EXISTS {name} ({fields})"
+    def rollback(self):
+        conn = self.conn
+        depth = self._transactions.get(conn, 1) - 1
+        if depth == 0:
+            self._transactions.pop(conn, None)
+            conn.rollback()
+            # cached rows may have been read from the writes being undone
+            if self.cache is not None:
+                self.cache.clear()
+        else:
+            self._transactions[conn] = depth
+            conn.execute(f"ROLLBACK TO SAVEPOINT bumbov_{depth}")
+            conn.execute(f"RELEASE SAVEPOINT bumbov_{depth}")
+            if self.cache is not None:
+                self.cache.clear()
 
-        fields = [
-            "id INTEGER PRIMARY KEY AUTOINCREMENT"
-        ]
+    @contextmanager
+    def transaction(self):
+        conn = self.conn
+        self.begin()
+        try:
+            yield conn
+        except BaseException:
+            self.rollback()
+            raise
+        else:
+            self.commit()
 
-        for name, field in inspect.getmembers(cls):
-            if isinstance(field, Column):
-                fields.append(f"{name} {field.sql_type}")
-            elif isinstance(field, ForeignKey):
-                fields.append(f"{name}_id INTEGER")
+    def _in_transaction(self):
+        conn = self.conn
+        return conn in self._transactions or conn.in_transaction
 
-        fields = ", ".join(fields)
-        name = cls.__name__.lower()
-        return CREATE_TABLE_SQL.format(name=name, fields=fields)
+    def _commit(self):
+        # inside db.transaction() the outermost block commits once at the end
+        conn = self.conn
+        if conn not in self._transactions:
+            conn.commit()
 
 
-    
-    def _get_insert_sql(self):
-        INSERT_SQL = "INSERT INTO {name} ({fields}) VALUES ({placeholders});"
-        cls = self.__class__
-        fields = []
-        placeholders = []
-        values = []
+def _in_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
 
-        for name, field in inspect.getmembers(cls):
-            if isinstance(field, Column):
-                fields.append(name)
-                values.append(getattr(self, name))
-                placeholders.append("?")
-            elif isinstance(field, ForeignKey):
-                fields.append(name + "_id")
-                values.append(getattr(self, name).id)
-                placeholders.append("?")
 
-        fields = ", ".join(fields)
-        placeholders = ", ".join(placeholders)
+def _row_key(table, id):
+    # ids taken from URLs are strings, rows are keyed by the integer primary key
+    try:
+        return table, int(id)
+    except (TypeError, ValueError):
+        return table, id
 
-        sql = INSERT_SQL.format(name=cls.__name__.lower(), fields=fields, placeholders=placeholders)
 
-        return sql, values
+def _batches(instances, batch_size):
+    # consecutive instances of the same model are sent together, at most batch_size at a time
+    for table, group in groupby(instances, type):
+        group = list(group)
+        for start in range(0, len(group), batch_size):
+            yield table, group[start:start + batch_size]
 
-    @classmethod
-    def _get_select_all_sql(cls):
-        SELECT_ALL_SQL = "SELECT {fields} FROM {name};"
-        fields = ["id"]
-
-        for name, field in inspect.getmembers(cls):
-            if isinstance(field, Column):
-                fields.append(name)
-            elif isinstance(field, ForeignKey):
-                fields.append(name + "_id")
-        
-        name = cls.__name__.lower()
-        sql = SELECT_ALL_SQL.format(fields=", ".join(fields), name=name)
-        return sql, fields
 
-    @classmethod
-    def _get_select_where_sql(cls, id):
-        SELECT_WHERE_SQL = "SELECT {fields} FROM {name} WHERE id = ?;"
-        fields = ["id"]
-        for name, field in inspect.getmembers(cls):
-            if isinstance(field, Column):
-                fields.append(name)
-            elif isinstance(field, ForeignKey):
-                fields.append(name + "_id")
-        
-        name = cls.__name__.lower()
-        sql = SELECT_WHERE_SQL.format(fields=", ".join(fields), name=name)
-        params = [id]
-        return sql, fields, params
+class AsyncDatabase:
 
-    def _get_update_sql(self):
+    def __init__(self, database, readers=4):
+        self.database = database
+        self._connections = []
+        # writes are serialized on one thread; reads run on a pool of their own,
+        # so with WAL they never wait for a writer. Every worker keeps its own
+        # thread-local connection.
+        self._writer = ThreadPoolExecutor(1, "bumbov-writer", initializer=self._open)
+        self._readers = ThreadPoolExecutor(readers, "bumbov-reader", initializer=self._open)
 
-        UPDATE_SQL = "UPDATE {name} SET {fields} WHERE id = ?;"
-        cls = self.__class__
+    def _open(self):
+        self._connections.append(self.database.conn)
 
-        fields = []
-        values = []
-        for name, field in inspect.getmembers(cls):
-            if isinstance(field, Column):
-                fields.append(f"{name} = ?")
-                values.append(getattr(self, name))
-            elif isinstance(field, ForeignKey):
-                fields.append(f"{name}_id = ?")
-                values.append(getattr(self, name).id)
+    async def read(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._readers, partial(func, *args))
 
-        values.append(getattr(self, 'id'))
-        sql = UPDATE_SQL.format(name=cls.__name__.lower(), fields=', '.join(fields))
-        return sql, values
+    async def write(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._writer, partial(func, *args))
 
-    @classmethod
-    def _get_delete_sql(cls, id):
-        DELETE_SQL = "DELETE FROM {name} WHERE id = ?;"
-        sql = DELETE_SQL.format(name=cls.__name__.lower())
-        params = [id]
-        return sql, params
+    async def create(self, table):
+        await self.write(self.database.create, table)
+
+    async def save(self, instance):
+        await self.write(self.database.save, instance)
+
+    async def update(self, instance):
+        await self.write(self.database.update, instance)
+
+    async def delete(self, table, id):
+        await self.write(self.database.delete, table, id)
+
+    async def bulk_save(self, instances, batch_size=1000):
+        await self.write(self.database.bulk_save, instances, batch_size)
+
+    async def bulk_update(self, instances, batch_size=1000):
+        await self.write(self.database.bulk_update, instances, batch_size)
+
+    async def bulk_delete(self, table, ids, batch_size=1000):
+        await self.write(self.database.bulk_delete, table, ids, batch_size)
 
+    # related rows are always loaded on the worker: a LazyReference would run a
+    # blocking query on the event loop the first time it is read
+    async def all(self, table):
+        return await self.read(self.database.all, table, False)
 
-class Column:
+    async def get(self, table, id):
+        return await self.read(self.database.get, table, id, False)
+
+    async def iterate(self, table, chunk_size=500, limit=None, after=None):
+        # every chunk is its own keyset query, so no cursor is left open on a worker
+        while limit is None or limit > 0:
+            size = chunk_size if limit is None else min(chunk_size, limit)
+            query = self.database.query(table).order_by("id").limit(size)
+            if after is not None:
+                query = query.filter(id__gt=after)
+            instances = await self.read(query.all, False)
+            for instance in instances:
+                yield instance
+            if len(instances) < size:
+                break
+            after = instances[-1].id
+            if limit is not None:
+                limit -= len(instances)
+
+    def close(self):
+        self._writer.shutdown()
+        self._readers.shutdown()
+        for conn in self._connections:
+            conn.close()
+        self._connections.clear()
+
+
+class Field:
+    slot = None
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        try:
+            return self.slot.__get__(instance, owner)
+        except AttributeError:
+            return None
+
+    def __set__(self, instance, value):
+        self.slot.__set__(instance, value)
+
+
+class Column(Field):
     
-    def __init__(self, column_type):
+    def __init__(self, column_type, index=False, unique=False):
         self.type = column_type
+        self.index = index
+        self.unique = unique
 
     @property
     def sql_type(self):
@@ -204,6 +647,426 @@ class Column:
         return SQLITE_TYPE_MAP[self.type]
 
 
-class ForeignKey:
-    def __init__(self, table):
+class ForeignKey(Field):
+    def __init__(self, table, index=True):
+        self.table = table
+        self.index = index
+
+    def __get__(self, instance, owner=None):
+        value = super().__get__(instance, owner)
+        if type(value) is LazyReference:
+            value = value.load()
+            self.slot.__set__(instance, value)
+        return value
+
+
+class Index:
+    def __init__(self, *fields, unique=False):
+        assert fields, "An index needs at least one field"
+        self.fields = fields
+        self.unique = unique
+
+
+class TableMeta(type):
+
+    def __new__(mcs, name, bases, namespace):
+        # Field values live in slots next to the Column/ForeignKey descriptors,
+        # so instances have no __dict__ and attribute access stays cheap.
+        fields = [attr for attr, value in namespace.items() if isinstance(value, Field)]
+        namespace = dict(namespace)
+        namespace["__slots__"] = tuple(namespace.get("__slots__", ())) + tuple(
+            f"_field_{attr}" for attr in fields
+        )
+        return super().__new__(mcs, name, bases, namespace)
+
+    def __init__(cls, name, bases, namespace):
+        super().__init__(name, bases, namespace)
+        for attr, value in namespace.items():
+            if isinstance(value, Field):
+                value.slot = cls.__dict__[f"_field_{attr}"]
+
+        # Everything that only depends on the class is computed once here
+        # instead of calling inspect.getmembers on every query.
+        cls._table_name = name.lower()
+        cls._members = [
+            (attr, field) for attr, field in inspect.getmembers(cls)
+            if isinstance(field, (Column, ForeignKey))
+        ]
+        cls._columns = [
+            attr if isinstance(field, Column) else f"{attr}_id"
+            for attr, field in cls._members
+        ]
+        cls._select_fields = ["id"] + cls._columns
+        cls._slots = {"id": cls.id}
+        cls._slots.update((column, field.slot) for column, (_, field) in zip(cls._columns, cls._members))
+
+        definitions = ["id INTEGER PRIMARY KEY AUTOINCREMENT"] + [
+            f"{attr} {field.sql_type}" if isinstance(field, Column) else f"{attr}_id INTEGER"
+            for attr, field in cls._members
+        ]
+        select_fields = ", ".join(cls._select_fields)
+
+        cls._create_sql = "CREATE TABLE IF NOT EXISTS {name} ({fields})".format(
+            name=cls._table_name, fields=", ".join(definitions)
+        )
+        cls._insert_sql = "INSERT INTO {name} ({fields}) VALUES ({placeholders});".format(
+            name=cls._table_name, fields=", ".join(cls._columns),
+            placeholders=", ".join("?" for _ in cls._columns),
+        )
+        cls._select_sql = "SELECT {fields} FROM {name}".format(
+            fields=select_fields, name=cls._table_name
+        )
+        cls._select_all_sql = f"{cls._select_sql};"
+        cls._select_where_sql = "SELECT {fields} FROM {name} WHERE id = ?;".format(
+            fields=select_fields, name=cls._table_name
+        )
+        cls._select_in_sql = "SELECT {fields} FROM {name} WHERE id IN ({{placeholders}});".format(
+            fields=select_fields, name=cls._table_name
+        )
+        cls._update_sql = "UPDATE {name} SET {fields} WHERE id = ?;".format(
+            name=cls._table_name, fields=", ".join(f"{column} = ?" for column in cls._columns)
+        )
+        cls._delete_sql = "DELETE FROM {name} WHERE id = ?;".format(name=cls._table_name)
+
+        indexes = []
+        for attr, field in cls._members:
+            if isinstance(field, Column) and (field.index or field.unique):
+                indexes.append((f"{cls._table_name}_{attr}_idx", (attr,), field.unique))
+            elif isinstance(field, ForeignKey) and field.index:
+                indexes.append((f"{cls._table_name}_{attr}_id_idx", (f"{attr}_id",), False))
+        for attr, index in inspect.getmembers(cls, lambda member: isinstance(member, Index)):
+            columns = tuple(
+                f"{field}_id" if isinstance(getattr(cls, field, None), ForeignKey) else field
+                for field in index.fields
+            )
+            indexes.append((f"{cls._table_name}_{attr}", columns, index.unique))
+        cls._create_index_sqls = [
+            "CREATE {unique}INDEX IF NOT EXISTS {index} ON {name} ({columns})".format(
+                unique="UNIQUE " if unique else "", index=index, name=cls._table_name,
+                columns=", ".join(columns),
+            )
+            for index, columns, unique in indexes
+        ]
+
+
+class Table(metaclass=TableMeta):
+    __slots__ = ("id",)
+
+    def __init__(self, **kwargs):
+        self.id = None
+
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    @classmethod
+    def _get_create_sql(cls):
+        return cls._create_sql
+
+    @classmethod
+    def _get_create_index_sqls(cls):
+        return cls._create_index_sqls
+
+    def _get_values(self):
+        values = []
+        for name, field in self._members:
+            value = getattr(self, name)
+            if isinstance(field, ForeignKey) and value is not None:
+                value = value.id
+            values.append(value)
+        return values
+
+    def _get_insert_sql(self):
+        return self._insert_sql, self._get_values()
+
+    @classmethod
+    def _get_select_all_sql(cls):
+        return cls._select_all_sql, cls._select_fields
+
+    @classmethod
+    def _get_select_where_sql(cls, id):
+        return cls._select_where_sql, cls._select_fields, [id]
+
+    @classmethod
+    def _get_select_in_sql(cls, ids):
+        sql = cls._select_in_sql.format(placeholders=", ".join("?" for _ in ids))
+        return sql, cls._select_fields, list(ids)
+
+    def _get_update_sql(self):
+        values = self._get_values()
+        values.append(getattr(self, 'id'))
+        return self._update_sql, values
+
+    @classmethod
+    def _get_delete_sql(cls, id):
+        return cls._delete_sql, [id]
+
+
+class Query:
+
+    OPERATORS = {
+        "exact": "=",
+        "ne": "!=",
+        "gt": ">",
+        "gte": ">=",
+        "lt": "<",
+        "lte": "<=",
+        "in": "IN",
+        "isnull": "IS NULL",
+    }
+
+    # compiled statement text, keyed by the shape of the query rather than its values
+    statements = LRUCache(maxsize=1024)
+
+    def __init__(self, database, table):
+        self.database = database
+        self.table = table
+        self._filters = ()
+        self._order_by = ()
+        self._only = None
+        self._limit = None
+        self._offset = None
+
+    def _clone(self, **changes):
+        query = Query.__new__(Query)
+        query.__dict__.update(self.__dict__)
+        query.__dict__.update(changes)
+        return query
+
+    def filter(self, **lookups):
+        filters = list(self._filters)
+        for lookup, value in lookups.items():
+            name, _, operator = lookup.partition("__")
+            operator = operator or "exact"
+            if operator not in self.OPERATORS:
+                raise AttributeError(f"Unknown lookup {lookup} on {self.table.__name__}")
+            if operator == "exact" and value is None:
+                operator, value = "isnull", True
+
+            if isinstance(value, Table):
+                value = value.id
+            elif operator == "in":
+                value = tuple(item.id if isinstance(item, Table) else item for item in value)
+            filters.append((self._column(name), operator, value))
+        return self._clone(_filters=tuple(filters))
+
+    def order_by(self, *fields):
+        order_by = tuple(
+            (self._column(field[1:]), True) if field.startswith("-") else (self._column(field), False)
+            for field in fields
+        )
+        return self._clone(_order_by=self._order_by + order_by)
+
+    def only(self, *fields):
+        columns = ["id"] + [self._column(field) for field in fields if field != "id"]
+        return self._clone(_only=tuple(columns))
+
+    def limit(self, limit):
+        return self._clone(_limit=limit)
+
+    def offset(self, offset):
+        return self._clone(_offset=offset)
+
+    def all(self, lazy=None):
+        sql, fields, params = self._compile("select")
+        rows = self.database.fetchall(sql, params)
+        return self.database._build_instances(self.table, fields, rows, {}, lazy)
+
+    def iterator(self, chunk_size=500, lazy=None):
+        sql, fields, params = self._compile("select")
+        return self.database._iterate_rows(self.table, sql, fields, params, chunk_size, lazy)
+
+    def __iter__(self):
+        return self.iterator()
+
+    def values(self, *fields):
+        sql, columns, params = self._project(fields)._compile("select")
+        names = fields or columns
+        rows = self.database.fetchall(sql, params)
+        return [dict(zip(names, row)) for row in rows]
+
+    def tuples(self, *fields):
+        sql, _, params = self._project(fields)._compile("select")
+        return self.database.fetchall(sql, params)
+
+    def _project(self, fields):
+        # values() and tuples() select exactly the requested fields, without forcing id
+        if not fields:
+            return self
+        return self._clone(_only=tuple(self._column(field) for field in fields))
+
+    def first(self):
+        instances = self.limit(1).all()
+        return instances[0] if instances else None
+
+    def count(self):
+        sql, _, params = self._compile("count")
+        return self.database.fetchone(sql, params)[0]
+
+    def exists(self):
+        sql, _, params = self._compile("exists")
+        return self.database.fetchone(sql, params) is not None
+
+    def explain(self):
+        return self.database.explain(self)
+
+    def _column(self, name):
+        if name == "id" or name in self.table._columns:
+            return name
+        field = getattr(self.table, name, None)
+        if isinstance(field, ForeignKey):
+            return f"{name}_id"
+        raise AttributeError(f"{self.table.__name__} has no field {name}")
+
+    def _compile(self, kind):
+        params = []
+        shape = []
+        for column, operator, value in self._filters:
+            if operator == "in":
+                shape.append((column, operator, len(value)))
+                params.extend(value)
+            elif operator == "isnull":
+                shape.append((column, operator, bool(value)))
+            else:
+                shape.append((column, operator, None))
+                params.append(value)
+        if self._limit is not None or self._offset is not None:
+            params.extend([-1 if self._limit is None else self._limit, self._offset or 0])
+
+        key = (
+            kind, self.table, tuple(shape), self._order_by, self._only,
+            self._limit is not None or self._offset is not None,
+        )
+        compiled = self.statements.get(key)
+        if compiled is MISSING:
+            compiled = self._build_sql(kind, shape)
+            self.statements.set(key, compiled)
+        sql, fields = compiled
+        return sql, fields, params
+
+    def _build_sql(self, kind, shape):
+        fields = list(self._only) if self._only is not None else self.table._select_fields
+        paginated = self._limit is not None or self._offset is not None
+        if kind == "count" and not paginated:
+            columns = "COUNT(*)"
+        elif kind == "exists" and not paginated:
+            columns = "1"
+        else:
+            columns = ", ".join(fields)
+        sql = f"SELECT {columns} FROM {self.table._table_name}"
+
+        conditions = []
+        for column, operator, extra in shape:
+            if operator == "in":
+                conditions.append(f"{column} IN ({', '.join('?' for _ in range(extra))})")
+            elif operator == "isnull":
+                conditions.append(f"{column} IS NULL" if extra else f"{column} IS NOT NULL")
+            else:
+                conditions.append(f"{column} {self.OPERATORS[operator]} ?")
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+
+        if self._order_by and (kind == "select" or paginated):
+            sql += " ORDER BY " + ", ".join(
+                f"{column} DESC" if descending else column for column, descending in self._order_by
+            )
+        if paginated:
+            sql += " LIMIT ? OFFSET ?"
+
+        if kind == "count" and paginated:
+            sql = f"SELECT COUNT(*) FROM ({sql})"
+        elif kind == "exists":
+            sql = f"SELECT 1 FROM ({sql}) LIMIT 1" if paginated else f"{sql} LIMIT 1"
+        return sql + ";", fields
+
+
+class LazyReference:
+    __slots__ = ("database", "table", "id", "instance")
+
+    def __init__(self, database, table, id):
+        self.database = database
         self.table = table
+        self.id = id
+        self.instance = None
+
+    def load(self):
+        # rows pointing at the same id share one reference, so it is loaded once
+        if self.instance is None:
+            self.instance = self.database.get(self.table, id=self.id)
+        return self.instance
+
+
+class DatabaseMiddleware(Middleware):
+    def __init__(self, app, database):
+        super().__init__(app)
+        self.database = database
+        self._tokens = f"bumbov.database_{id(self)}"
+
+    def process_request(self, request):
+        if _in_event_loop():
+            return self._process_request_async(request)
+        self.database.acquire()
+        self._begin_request(request)
+
+    async def _process_request_async(self, request):
+        await self.database.acquire_async()
+        self._begin_request(request)
+
+    def process_response(self, request, response):
+        try:
+            self._end_request(request)
+        finally:
+            self.database.release()
+
+    def process_exception(self, request, exception):
+        try:
+            self._end_request(request)
+        finally:
+            self.database.release()
+
+    def _begin_request(self, request):
+        # the tokens live on the request, since one middleware instance serves every request
+        identity_token = profile_token = None
+        if self.database.use_identity_map:
+            identity_token = self.database._identity_map.set({})
+        if self.database.profiler is not None:
+            profile_token = self.database.profiler.start()
+        request.environ[self._tokens] = (identity_token, profile_token)
+
+    def _end_request(self, request):
+        tokens = request.environ.pop(self._tokens, None)
+        if tokens is None:
+            return
+        identity_token, profile_token = tokens
+        if identity_token is not None:
+            self.database._identity_map.reset(identity_token)
+        if profile_token is not None:
+            profile = self.database.profiler.stop(profile_token)
+            timing = request.environ.get("bumbov.timing")
+            if timing is not None:
+                timing.queries = profile.summary()
+
+
+class TransactionMiddleware(DatabaseMiddleware):
+    def _begin_request(self, request):
+        self.database.begin()
+        super()._begin_request(request)
+
+    def process_response(self, request, response):
+        # a failed commit must still hand the connection back to the pool
+        try:
+            self._end_request(request)
+            if "bumbov.exception" in request.environ:
+                self.database.rollback()
+            else:
+                self.database.commit()
+        finally:
+            self.database.release()
+
+    def process_exception(self, request, exception):
+        try:
+            self._end_request(request)
+            # process_response may have released the connection before raising
+            if self.database._bound.get() is not None:
+                self.database.rollback()
+        finally:
+            self.database.release()
@@ -1,38 +1,229 @@
 import json
+import mimetypes
+import os
+from collections.abc import Iterator
+from functools import partial
+from http import HTTPStatus
 
 from webob import Response as WebObResponse
+from webob.cookies import make_cookie
+from webob.headers import ResponseHeaders
+
+try:
+    from orjson import OPT_NON_STR_KEYS, dumps as _fast_json_dumps
+    _fast_json_dumps = partial(_fast_json_dumps, option=OPT_NON_STR_KEYS)
+except ImportError:
+    try:
+        from ujson import dumps as _fast_json_dumps
+    except ImportError:
+        _fast_json_dumps = None
+
+
+def json_dumps(obj):
+    if _fast_json_dumps is not None:
+        try:
+            return _fast_json_dumps(obj)
+        except (TypeError, OverflowError):
+            # orjson and ujson are stricter than json (e.g. integers over 64 bits),
+            # so anything they reject gets a second chance with the standard library
+            pass
+    return json.dumps(obj)
+
+
+STATUS_LINES = {status.value: f"{status.value} {status.phrase}" for status in HTTPStatus}
+STREAM_CHUNK_SIZE = 64 * 1024
 
 
 class Response:
-    def __init__(self) -> None:
+    def __init__(self, json_serializer=None) -> None:
         self.json = None
+        self.ndjson = None
         self.html = None
         self.text = None
         self.content_type = None
         self.body = b''
         self.status_code = 200
+        # header names are case-insensitive, and a name may be repeated
+        self.headers = ResponseHeaders()
+        self.cookies = []
+        self.conditional_response = False
+        self.json_serializer = json_serializer or json_dumps
 
 
     def __call__(self, environ, start_response):
         self.set_body_and_content_type()
+        if hasattr(self.body, "__aiter__") and "asgi.scope" not in environ:
+            # fail before any header is sent, rather than when the server iterates the body
+            raise TypeError("Async iterable bodies can only be sent when the app runs under ASGI")
+
+        status = STATUS_LINES.get(self.status_code)
+        if status is None or self.conditional_response:
+            return self.to_webob(environ)(environ, start_response)
+
+        start_response(status, self.headerlist)
+        if environ["REQUEST_METHOD"] == "HEAD":
+            close = getattr(self.body, "close", None)
+            if close is not None:
+                close()
+            return []
+        return self.get_app_iter(environ)
+
+    def get_app_iter(self, environ):
+        body = self.body
+        if isinstance(body, bytes):
+            return [body]
+        if hasattr(body, "read"):
+            file_wrapper = environ.get("wsgi.file_wrapper")
+            if file_wrapper is not None:
+                return file_wrapper(body, STREAM_CHUNK_SIZE)
+            return _iter_file(body)
+        if hasattr(body, "__aiter__"):
+            return _aiter_chunks(body)
+        return _iter_chunks(body)
 
+    @property
+    def headerlist(self):
+        headerlist = []
+        if "Content-Type" not in self.headers:
+            headerlist.append(("Content-Type", _content_type_header(self.content_type)))
+        if isinstance(self.body, bytes) and "Content-Length" not in self.headers:
+            headerlist.append(("Content-Length", str(len(self.body))))
+        headerlist.extend(self.headers.items())
+        for cookie in self.cookies:
+            headerlist.append(("Set-Cookie", cookie))
+        return headerlist
+
+    def to_webob(self, environ):
         response = WebObResponse(
-            body=self.body, content_type=self.content_type, status=self.status_code
+            content_type=self.content_type, status=self.status_code,
+            conditional_response=self.conditional_response,
         )
-        return response(environ, start_response)
+        if isinstance(self.body, bytes):
+            response.body = self.body
+        else:
+            response.app_iter = self.get_app_iter(environ)
+        for name, value in self.headers.items():
+            if name.lower() in ("content-type", "content-length"):
+                response.headers[name] = value
+            else:
+                response.headerlist.append((name, value))
+        for cookie in self.cookies:
+            response.headerlist.append(("Set-Cookie", cookie))
+        return response
+
+    def set_cookie(self, name, value, max_age=None, path="/", domain=None,
+                   secure=False, httponly=False, samesite=None):
+        self.cookies.append(make_cookie(
+            name, value, max_age=max_age, path=path, domain=domain,
+            secure=secure, httponly=httponly, samesite=samesite,
+        ))
+
+    def delete_cookie(self, name, path="/", domain=None):
+        self.set_cookie(name, None, path=path, domain=domain)
+
+
+    def dumps(self, obj):
+        data = self.json_serializer(obj)
+        if isinstance(data, str):
+            return data.encode("UTF-8")
+        return data
 
-    
     def set_body_and_content_type(self):
-        if self.json is not None:
-            self.body = json.dumps(self.json).encode("UTF-8")
-            self.content_type = "application/json"
-        
-        if self.html is not None:
-            self.body = self.html.encode("UTF-8")
-            self.content_type = "text/html"
-        
+        # text wins over html, which wins over json and ndjson
         if self.text is not None:
-            self.body = self.text
+            self.body = self.text.encode("UTF-8")
             self.content_type = "text/plain"
+        elif self.html is not None:
+            if isinstance(self.html, Iterator):
+                self.body = self.html
+            else:
+                self.body = self.html.encode("UTF-8")
+            self.content_type = "text/html"
+        elif self.json is not None:
+            if isinstance(self.json, Iterator):
+                self.body = _stream_json(self.json, self.dumps, b"[", b",", b"]")
+            else:
+                self.body = self.dumps(self.json)
+            self.content_type = "application/json"
+        elif self.ndjson is not None:
+            self.body = _stream_json(self.ndjson, self.dumps, b"", b"\n", b"\n")
+            self.content_type = "application/x-ndjson"
+        elif isinstance(self.body, str):
+            self.body = self.body.encode("UTF-8")
+
+
+def _content_type_header(content_type):
+    if content_type is None:
+        return "text/html; charset=UTF-8"
+    if "charset=" in content_type:
+        return content_type
+    if content_type.startswith("text/") or content_type.endswith("xml"):
+        return f"{content_type}; charset=UTF-8"
+    return content_type
+
+
+def _stream_json(records, dumps, start, separator, end):
+    # records are serialized one by one and flushed in chunks of STREAM_CHUNK_SIZE
+    chunk = bytearray(start)
+    empty = True
+    for record in records:
+        if not empty:
+            chunk += separator
+        chunk += dumps(record)
+        empty = False
+        if len(chunk) >= STREAM_CHUNK_SIZE:
+            yield bytes(chunk)
+            chunk.clear()
+    if not empty or start:
+        chunk += end
+    yield bytes(chunk)
+
+
+def _iter_chunks(chunks):
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("UTF-8")
+            yield chunk
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
 
-        
\ No newline at end of file
+
+async def _aiter_chunks(chunks):
+    async for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("UTF-8")
+        yield chunk
+
+
+def _iter_file(file):
+    try:
+        while True:
+            chunk = file.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            if isinstance(chunk, str):
+                chunk = chunk.encode("UTF-8")
+            yield chunk
+    finally:
+        file.close()
+
+
+class FileResponse(Response):
+    def __init__(self, path, content_type=None, filename=None) -> None:
+        super().__init__()
+        self.path = path
+        self.content_type = content_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+        self.headers["Content-Length"] = str(os.path.getsize(path))
+        self.opened = False
+        if filename is not None:
+            self.headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+
+    def set_body_and_content_type(self):
+        # the file is only opened once the response is actually sent, and never
+        # again once the body has been replaced, e.g. by a 304
+        if not self.opened:
+            self.opened = True
+            self.body = open(self.path, "rb")
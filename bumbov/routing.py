@@ -0,0 +1,92 @@
+from parse import compile as compile_pattern
+
+
+class _Node:
+    __slots__ = ("static", "dynamic", "handler_data")
+
+    def __init__(self):
+        self.static = {}
+        self.dynamic = []
+        self.handler_data = None
+
+
+class _Segment:
+    __slots__ = ("pattern", "name", "parser")
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.name = None
+        self.parser = None
+
+        inner = pattern[1:-1]
+        if (
+            pattern.startswith("{") and pattern.endswith("}")
+            and inner.isidentifier()
+        ):
+            # plain "{name}" segments match any non-empty value, no regex needed
+            self.name = inner
+        else:
+            self.parser = compile_pattern(pattern)
+
+    def match(self, value):
+        if self.parser is None:
+            if value:
+                return {self.name: value}
+            return None
+
+        result = self.parser.parse(value)
+        if result is None:
+            return None
+        return result.named
+
+
+class Router:
+
+    def __init__(self):
+        self.root = _Node()
+
+    def add(self, path, handler_data):
+        node = self.root
+        for part in path.split("/"):
+            if "{" in part:
+                for segment, child in node.dynamic:
+                    if segment.pattern == part:
+                        break
+                else:
+                    child = _Node()
+                    node.dynamic.append((_Segment(part), child))
+                node = child
+            else:
+                # parse() matches case-insensitively, so static segments do too
+                node = node.static.setdefault(part.lower(), _Node())
+        node.handler_data = handler_data
+
+    def match(self, request_path):
+        parts = request_path.split("/")
+        kwargs = {}
+        handler_data = self._match(self.root, parts, 0, kwargs)
+        if handler_data is None:
+            return None, None
+        return handler_data, kwargs
+
+    def _match(self, node, parts, index, kwargs):
+        if index == len(parts):
+            return node.handler_data
+
+        part = parts[index]
+        child = node.static.get(part.lower())
+        if child is not None:
+            handler_data = self._match(child, parts, index + 1, kwargs)
+            if handler_data is not None:
+                return handler_data
+
+        for segment, child in node.dynamic:
+            named = segment.match(part)
+            if named is None:
+                continue
+            handler_data = self._match(child, parts, index + 1, kwargs)
+            if handler_data is not None:
+                kwargs.update(named)
+                return handler_data
+
+        return None
@@ -25,7 +25,8 @@ def db():
     if os.path.exists(DB_PATH):
         os.remove(DB_PATH)
     db = Database(DB_PATH)
-    return db
+    yield db
+    db.close()
 
 
 @pytest.fixture
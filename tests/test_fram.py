@@ -1,6 +1,16 @@
+import asyncio
+import gzip
+import io
+import json
+import os
+
 import pytest
+from webob import Request
 from bumbov.api import API
+from bumbov.compression import CompressionMiddleware, main as compress_main
+from bumbov.metrics import Metrics, MetricsSink
 from bumbov.middleware import Middleware
+from bumbov.response import FileResponse, Response
 
 
 FILE_DIR="css"
@@ -141,6 +151,46 @@ def test_assets_are_served(tmpdir_factory, base_url):
     assert response.status_code == 200
 
 
+def test_static_prefix(tmpdir_factory, base_url):
+    static_dir = tmpdir_factory.mktemp("static")
+    _create_static(static_dir)
+    api = API(static_dir=static_dir, static_prefix="/assets")
+    client = api.test_session()
+    environs = []
+
+    @api.route("/static/{path}")
+    def not_static(req, res, path):
+        environs.append(req.environ)
+        res.text = "handler"
+
+    assert client.get(f"{base_url}/assets/{FILE_DIR}/{FILE_NAME}").text == FILE_CONTENTS
+    assert client.get(f"{base_url}/static/main.css").text == "handler"
+    assert client.get(f"{base_url}/assets/missing.css").status_code == 404
+    assert environs[0]["PATH_INFO"] == "/static/main.css"
+
+
+def test_hashed_static_urls_are_immutable(tmpdir_factory, base_url):
+    static_dir = tmpdir_factory.mktemp("static")
+    asset = _create_static(static_dir)
+    templates_dir = tmpdir_factory.mktemp("templates")
+    templates_dir.join("page.html").write("<link href=\"{{ static_url('css/main.css') }}\">")
+    api = API(static_dir=static_dir, template_dir=str(templates_dir))
+    client = api.test_session()
+
+    url = api.static_url("css/main.css")
+    assert url.startswith("/static/css/main.") and url.endswith(".css") and url != "/static/css/main.css"
+    assert api.template("page.html") == f'<link href="{url}">'
+    assert api.static_url("/missing.js") == "/static/missing.js"
+
+    response = client.get(base_url + url)
+    assert response.text == FILE_CONTENTS
+    assert response.headers["Cache-Control"] == "max-age=315360000, public, immutable"
+    assert client.get(f"{base_url}/static/css/main.css").headers["Cache-Control"] == "max-age=60, public"
+
+    asset.write("body {background-color: blue}")
+    assert API(static_dir=static_dir).static_url("css/main.css") != url
+
+
 def test_middleware_methods_are_called(api, client, base_url):
     process_request_called = False
     process_response_called = False
@@ -231,4 +281,887 @@ def test_mannualy_setting_body(api, client, base_url):
     
     response = client.get(base_url + "/text")
     assert response.headers["content-type"] == "text/plain; charset=UTF-8"
-    assert response.text == "TEXT"
\ No newline at end of file
+    assert response.text == "TEXT"
+
+# routing tests
+
+def test_typed_route_params_are_converted(api, client, base_url):
+    @api.route("/sum/{a:d}/{b:d}")
+    def sum_handler(req, res, a, b):
+        res.text = str(a + b)
+
+    assert client.get(base_url + "/sum/2/3").text == "5"
+    assert client.get(base_url + "/sum/2/x").status_code == 404
+
+
+def test_static_segments_take_priority_over_params(api, client, base_url):
+    @api.route("/books/{name}")
+    def book(req, res, name):
+        res.text = f"book {name}"
+
+    @api.route("/books/new")
+    def new_book(req, res):
+        res.text = "new book"
+
+    assert client.get(base_url + "/books/new").text == "new book"
+    assert client.get(base_url + "/books/dune").text == "book dune"
+
+
+def test_route_params_mixed_with_static_text(api, client, base_url):
+    @api.route("/files/{name}.{ext}")
+    def file_handler(req, res, name, ext):
+        res.text = f"{name}|{ext}"
+
+    assert client.get(base_url + "/files/report.csv").text == "report|csv"
+
+
+def test_route_does_not_match_extra_segments(api, client, base_url):
+    @api.route("/test/{name}")
+    def test(req, res, name):
+        res.text = name
+
+    assert client.get(base_url + "/test/a/b").status_code == 404
+    assert client.get(base_url + "/test/").status_code == 404
+
+
+# route cache tests
+
+def test_route_cache_counts_hits_and_misses(base_url):
+    api = API(route_cache_size=2)
+    client = api.test_session()
+
+    @api.route("/hello/{name}")
+    def hello(req, res, name):
+        res.text = f"Hello {name}"
+
+    assert client.get(base_url + "/hello/John").text == "Hello John"
+    assert client.get(base_url + "/hello/John").text == "Hello John"
+    assert client.get(base_url + "/missing").status_code == 404
+    assert client.get(base_url + "/missing").status_code == 404
+
+    assert api.route_cache.hits == 2
+    assert api.route_cache.misses == 2
+
+    client.get(base_url + "/hello/Jane")
+    assert api.route_cache.evictions == 1
+
+
+def test_route_cache_is_invalidated_by_add_route(base_url):
+    api = API(route_cache_size=10)
+    client = api.test_session()
+
+    assert client.get(base_url + "/late").status_code == 404
+
+    @api.route("/late")
+    def late(req, res):
+        res.text = "late"
+
+    assert client.get(base_url + "/late").text == "late"
+
+
+def test_route_cache_is_disabled_by_default(api):
+    assert api.route_cache is None
+
+
+# ASGI tests
+
+def _asgi_request(api, method, path, body=b"", query_string=b""):
+    messages = []
+    request_messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        return request_messages.pop(0)
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "path": path,
+        "query_string": query_string,
+        "headers": [(b"host", b"testserver")],
+    }
+    asyncio.run(api.asgi(scope, receive, send))
+
+    start = messages[0]
+    headers = {name.decode(): value.decode() for name, value in start["headers"]}
+    response_body = b"".join(m.get("body", b"") for m in messages[1:])
+    return start["status"], headers, response_body
+
+
+def test_asgi_sync_handler(api):
+    @api.route("/hello/{name}")
+    def hello(req, res, name):
+        res.text = f"Hello {name} {req.params['greeting']}"
+
+    status, headers, body = _asgi_request(api, "GET", "/hello/John", query_string=b"greeting=hi")
+    assert status == 200
+    assert headers["content-type"] == "text/plain; charset=UTF-8"
+    assert body == b"Hello John hi"
+
+
+def test_asgi_async_function_and_class_handlers(api):
+    @api.route("/async")
+    async def async_handler(req, res):
+        await asyncio.sleep(0)
+        res.json = {"body": req.text}
+
+    @api.route("/books")
+    class BooksHandler:
+        async def post(self, req, res):
+            res.text = "created"
+
+    status, headers, body = _asgi_request(api, "POST", "/async", body=b"payload")
+    assert status == 200
+    assert json.loads(body) == {"body": "payload"}
+
+    status, _, body = _asgi_request(api, "POST", "/books")
+    assert body == b"created"
+
+
+def test_async_handlers_run_under_wsgi(api, client, base_url):
+    @api.route("/async")
+    async def async_handler(req, res):
+        await asyncio.sleep(0)
+        res.text = "async"
+
+    @api.route("/books")
+    class BooksHandler:
+        async def get(self, req, res):
+            res.json = {"name": "books"}
+
+    assert client.get(base_url + "/async").text == "async"
+    assert client.get(base_url + "/books").json() == {"name": "books"}
+
+
+def test_asgi_runs_middleware_and_exception_handler(api):
+    calls = []
+
+    class RecordingMiddleware(Middleware):
+        def process_request(self, req):
+            calls.append("request")
+
+        def process_response(self, req, resp):
+            calls.append("response")
+
+    def on_exception(req, res, exc):
+        res.status_code = 500
+        res.text = "handled"
+
+    api.add_middleware(RecordingMiddleware)
+    api.add_exception_handler(on_exception)
+
+    @api.route("/fail")
+    async def fail(req, res):
+        raise ValueError()
+
+    status, _, body = _asgi_request(api, "GET", "/fail")
+    assert status == 500
+    assert body == b"handled"
+    assert calls == ["request", "response"]
+
+
+def test_asgi_runs_middleware_overriding_handle_request(api, client, base_url):
+    calls = []
+
+    class WrappingMiddleware(Middleware):
+        def handle_request(self, request):
+            calls.append("sync")
+            response = self.app.handle_request(request)
+            response.headers["X-Wrapped"] = "sync"
+            return response
+
+    class AsyncWrappingMiddleware(Middleware):
+        async def handle_request(self, request):
+            calls.append("async")
+            return await self.app.handle_request_async(request)
+
+    @api.route("/home")
+    def home(req, res):
+        res.text = "Home"
+
+    api.add_middleware(WrappingMiddleware)
+    status, headers, body = _asgi_request(api, "GET", "/home")
+    assert (status, headers["x-wrapped"], body) == (200, "sync", b"Home")
+    assert client.get(f"{base_url}/home").headers["X-Wrapped"] == "sync"
+
+    api.add_middleware(AsyncWrappingMiddleware)
+    status, headers, body = _asgi_request(api, "GET", "/home")
+    assert (status, headers["x-wrapped"], body) == (200, "sync", b"Home")
+    assert calls == ["sync", "sync", "async", "sync"]
+
+
+def test_asgi_404_and_static_files(tmpdir_factory):
+    static_dir = tmpdir_factory.mktemp("static")
+    _create_static(static_dir)
+    api = API(static_dir=static_dir)
+
+    status, _, body = _asgi_request(api, "GET", "/missing")
+    assert status == 404
+
+    status, _, body = _asgi_request(api, "GET", f"/static/{FILE_DIR}/{FILE_NAME}")
+    assert status == 200
+    assert body == FILE_CONTENTS.encode()
+
+
+def test_middleware_order_and_short_circuit(api, client, base_url):
+    calls = []
+
+    class First(Middleware):
+        def process_request(self, req):
+            calls.append("first request")
+
+        def process_response(self, req, resp):
+            calls.append("first response")
+
+    class Blocking(Middleware):
+        def process_request(self, req):
+            calls.append("blocking request")
+            if req.path == "/blocked":
+                resp = Response()
+                resp.status_code = 403
+                resp.text = "Forbidden"
+                return resp
+
+        def process_response(self, req, resp):
+            calls.append("blocking response")
+
+    api.add_middleware(First)
+    api.add_middleware(Blocking)
+
+    @api.route("/blocked")
+    def blocked(req, res):
+        res.text = "should not run"
+
+    response = client.get(base_url + "/blocked")
+    assert response.status_code == 403
+    assert response.text == "Forbidden"
+    assert calls == ["blocking request", "blocking response"]
+
+    calls.clear()
+    client.get(base_url + "/open")
+    assert calls == ["blocking request", "first request", "first response", "blocking response"]
+
+
+def test_process_exception_runs_when_process_response_fails(api, client, base_url):
+    calls = []
+
+    class Outer(Middleware):
+        def process_response(self, req, resp):
+            calls.append("outer response")
+
+        def process_exception(self, req, exception):
+            calls.append("outer exception")
+
+    class Failing(Middleware):
+        def process_response(self, req, resp):
+            raise ValueError()
+
+        def process_exception(self, req, exception):
+            calls.append("failing exception")
+
+    api.add_middleware(Failing)
+    api.add_middleware(Outer)
+
+    @api.route("/home")
+    def home(req, res):
+        res.text = "home"
+
+    with pytest.raises(ValueError):
+        client.get(base_url + "/home")
+    assert calls == ["failing exception", "outer exception"]
+
+    calls.clear()
+    with pytest.raises(ValueError):
+        _asgi_request(api, "GET", "/home")
+    assert calls == ["failing exception", "outer exception"]
+
+
+def test_async_middleware_hooks(api):
+    calls = []
+
+    class AsyncMiddleware(Middleware):
+        async def process_request(self, req):
+            calls.append("request")
+
+        async def process_response(self, req, resp):
+            resp.text = resp.text.upper()
+
+    api.add_middleware(AsyncMiddleware)
+
+    @api.route("/test")
+    async def test(req, res):
+        res.text = "text"
+
+    status, _, body = _asgi_request(api, "GET", "/test")
+    assert body == b"TEXT"
+    assert calls == ["request"]
+
+
+def test_custom_headers_and_cookies(api, client, base_url):
+    @api.route("/headers")
+    def headers_handler(req, res):
+        res.text = "TEXT"
+        res.headers["X-Custom"] = "value"
+        res.set_cookie("session", "abc", httponly=True)
+
+    response = client.get(base_url + "/headers")
+    assert response.headers["X-Custom"] == "value"
+    assert response.headers["Content-Length"] == "4"
+    assert response.cookies["session"] == "abc"
+    assert "HttpOnly" in response.headers["Set-Cookie"]
+
+
+def test_headers_are_case_insensitive(api):
+    @api.route("/export")
+    def export(req, res):
+        res.text = "a,b"
+        res.headers["content-type"] = "text/csv"
+        res.headers.add("Link", "</a.css>; rel=preload")
+        res.headers.add("Link", "</b.css>; rel=preload")
+
+    @api.route("/private")
+    @api.cache(ttl=60)
+    def private(req, res):
+        res.text = "secret"
+        res.headers["cache-control"] = "private"
+
+    response = Request.blank("/export").get_response(api)
+    names = [name.lower() for name, _ in response.headerlist]
+    assert names.count("content-type") == 1
+    assert response.headers["Content-Type"] == "text/csv"
+    assert response.headers.getall("Link") == ["</a.css>; rel=preload", "</b.css>; rel=preload"]
+
+    Request.blank("/private").get_response(api)
+    assert len(api.cache_backend) == 0
+
+
+def test_response_status_codes(api, client, base_url):
+    @api.route("/created")
+    def created(req, res):
+        res.status_code = 201
+        res.json = {"id": 1}
+
+    @api.route("/custom")
+    def custom(req, res):
+        res.status_code = 599
+        res.text = "custom"
+
+    response = client.get(base_url + "/created")
+    assert response.status_code == 201
+    assert response.reason == "Created"
+
+    response = client.get(base_url + "/custom")
+    assert response.status_code == 599
+    assert response.text == "custom"
+
+
+def test_head_request_has_no_body(api, client, base_url):
+    @api.route("/text")
+    def text_handler(req, res):
+        res.text = "TEXT"
+
+    response = client.head(base_url + "/text")
+    assert response.headers["Content-Length"] == "4"
+    assert response.text == ""
+
+
+def test_conditional_response_falls_back_to_webob(api, client, base_url):
+    @api.route("/etag")
+    def etag_handler(req, res):
+        res.text = "TEXT"
+        res.headers["ETag"] = '"abc"'
+        res.conditional_response = True
+
+    response = client.get(base_url + "/etag", headers={"If-None-Match": '"abc"'})
+    assert response.status_code == 304
+
+
+# JSON serialization tests
+
+def test_default_json_serializer_accepts_what_json_accepts(api, client, base_url):
+    payload = {1: "int key", "big": 2 ** 70, "nested": [None, True, 1.5]}
+
+    @api.route("/payload")
+    def handler(req, res):
+        res.json = payload
+
+    assert client.get(f"{base_url}/payload").json() == json.loads(json.dumps(payload))
+
+
+def test_custom_json_serializer(base_url):
+    api = API(json_serializer=lambda obj: json.dumps(obj, sort_keys=True, indent=1))
+    client = api.test_session()
+
+    @api.route("/json")
+    def json_handler(req, res):
+        res.json = {"b": 1, "a": 2}
+
+    response = client.get(base_url + "/json")
+    assert response.text == '{\n "a": 2,\n "b": 1\n}'
+
+
+def test_streaming_json_array(api, client, base_url):
+    @api.route("/rows")
+    def rows(req, res):
+        res.json = ({"id": i} for i in range(10000))
+
+    response = client.get(base_url + "/rows")
+    assert response.headers["content-type"] == "application/json"
+    assert "Content-Length" not in response.headers
+    assert response.json() == [{"id": i} for i in range(10000)]
+
+
+def test_streaming_empty_json_array(api, client, base_url):
+    @api.route("/rows")
+    def rows(req, res):
+        res.json = iter([])
+
+    assert client.get(base_url + "/rows").json() == []
+
+
+def test_streaming_ndjson(api, client, base_url):
+    @api.route("/rows")
+    def rows(req, res):
+        res.ndjson = ({"id": i} for i in range(3))
+
+    response = client.get(base_url + "/rows")
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in response.text.splitlines()] == [{"id": 0}, {"id": 1}, {"id": 2}]
+
+
+# streaming tests
+
+def test_generator_body_is_streamed(api, client, base_url):
+    @api.route("/csv")
+    def csv_handler(req, res):
+        res.content_type = "text/csv"
+        res.body = (f"{i},row {i}\n" for i in range(3))
+
+    response = client.get(base_url + "/csv")
+    assert response.headers["content-type"] == "text/csv; charset=UTF-8"
+    assert "Content-Length" not in response.headers
+    assert response.text == "0,row 0\n1,row 1\n2,row 2\n"
+
+
+def test_file_like_body_is_streamed(api, client, base_url):
+    @api.route("/file")
+    def file_handler(req, res):
+        res.content_type = "application/octet-stream"
+        res.body = io.BytesIO(b"x" * 100000)
+
+    response = client.get(base_url + "/file")
+    assert response.content == b"x" * 100000
+
+
+def test_file_response(api, client, base_url, tmpdir):
+    export = tmpdir.join("export.csv")
+    export.write("a,b\n1,2\n")
+
+    @api.route("/export")
+    def export_handler(req, res):
+        return FileResponse(str(export), filename="export.csv")
+
+    response = client.get(base_url + "/export")
+    assert response.text == "a,b\n1,2\n"
+    assert response.headers["content-type"] == "text/csv; charset=UTF-8"
+    assert response.headers["Content-Length"] == "8"
+    assert response.headers["Content-Disposition"] == 'attachment; filename="export.csv"'
+
+
+def test_file_response_uses_wsgi_file_wrapper(tmpdir):
+    export = tmpdir.join("export.csv")
+    export.write("a,b\n")
+    wrapped = []
+
+    def file_wrapper(file, block_size):
+        wrapped.append(file)
+        return iter([file.read()])
+
+    environ = {"REQUEST_METHOD": "GET", "wsgi.file_wrapper": file_wrapper}
+    body = FileResponse(str(export))(environ, lambda status, headers: None)
+
+    assert list(body) == [b"a,b\n"]
+    assert len(wrapped) == 1
+
+
+def test_asgi_streams_sync_and_async_generators(api):
+    @api.route("/sync")
+    def sync_stream(req, res):
+        res.body = (f"chunk {i};" for i in range(3))
+
+    @api.route("/async")
+    async def async_stream(req, res):
+        async def chunks():
+            for i in range(3):
+                yield f"chunk {i};"
+        res.body = chunks()
+
+    for path in ("/sync", "/async"):
+        status, _, body = _asgi_request(api, "GET", path)
+        assert status == 200
+        assert body == b"chunk 0;chunk 1;chunk 2;"
+
+
+def test_async_bodies_are_rejected_under_wsgi(api):
+    @api.route("/async")
+    def async_stream(req, res):
+        async def chunks():
+            yield "chunk"
+        res.body = chunks()
+
+    started = []
+    with pytest.raises(TypeError, match="ASGI"):
+        api(Request.blank("/async").environ, lambda status, headers: started.append(status))
+    assert started == []
+
+
+# template tests
+
+def test_precompiled_templates_with_bytecode_cache(tmpdir):
+    cache_dir = tmpdir.join("jinja_cache")
+    api = API(template_auto_reload=False, template_cache_dir=str(cache_dir), precompile_templates=True)
+
+    assert api.template_env.auto_reload is False
+    assert len(api.template_env.cache) == len(api.template_env.list_templates())
+    assert len(cache_dir.listdir()) == len(api.template_env.list_templates())
+
+    html = api.template("index.html", context={"title": "Some Title", "name": "Some Name"})
+    assert "Some Title" in html
+
+
+def test_streamed_template(api, client, base_url):
+    @api.route("/html")
+    def html_handler(req, res):
+        res.html = api.template_stream("index.html", context={"title": "Some Title", "name": "Some Name"})
+
+    response = client.get(base_url + "/html")
+    assert response.headers["content-type"] == "text/html; charset=UTF-8"
+    assert "Content-Length" not in response.headers
+    assert "Some Title" in response.text
+    assert "Some Name" in response.text
+
+
+# response cache tests
+
+def test_cached_handler_runs_once(api, client, base_url):
+    calls = []
+
+    @api.route("/cached")
+    @api.cache(ttl=60)
+    def cached(req, res):
+        calls.append(1)
+        res.json = {"calls": len(calls)}
+
+    assert client.get(base_url + "/cached").json() == {"calls": 1}
+    response = client.get(base_url + "/cached")
+    assert response.json() == {"calls": 1}
+    assert response.headers["content-type"] == "application/json"
+    assert len(calls) == 1
+    assert api.cache_backend.hits == 1
+    assert api.cache_backend.misses == 1
+
+
+def test_cache_keys_and_bypass(api, client, base_url):
+    @api.route("/cached/{name}")
+    @api.cache(key=lambda req: req.path)
+    def cached(req, res, name):
+        res.text = f"{name} {req.params.get('v')}"
+
+    assert client.get(base_url + "/cached/a?v=1").text == "a 1"
+    assert client.get(base_url + "/cached/a?v=2").text == "a 1"
+    assert client.get(base_url + "/cached/b?v=2").text == "b 2"
+    response = client.get(base_url + "/cached/a?v=3", headers={"Cache-Control": "no-cache"})
+    assert response.text == "a 3"
+    assert client.post(base_url + "/cached/a?v=4").text == "a 4"
+
+
+def test_cache_respects_response_cache_control(api, client, base_url):
+    calls = []
+
+    @api.route("/private")
+    @api.cache()
+    def private(req, res):
+        calls.append(1)
+        res.text = "private"
+        res.headers["Cache-Control"] = "private"
+
+    client.get(base_url + "/private")
+    client.get(base_url + "/private")
+    assert len(calls) == 2
+
+
+def test_cache_expires_after_ttl(api, client, base_url, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("bumbov.cache.time.monotonic", lambda: now[0])
+
+    @api.route("/ttl")
+    @api.cache(ttl=10)
+    def ttl(req, res):
+        res.text = str(now[0])
+
+    assert client.get(base_url + "/ttl").text == "1000.0"
+    now[0] = 1005.0
+    assert client.get(base_url + "/ttl").text == "1000.0"
+    now[0] = 1011.0
+    assert client.get(base_url + "/ttl").text == "1011.0"
+
+
+def test_cache_etag_and_conditional_get(api, client, base_url):
+    @api.route("/etag")
+    @api.cache()
+    def etag(req, res):
+        res.text = "TEXT"
+
+    etag = client.get(base_url + "/etag").headers["ETag"]
+    response = client.get(base_url + "/etag", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+def test_cached_class_based_and_async_handlers(api):
+    calls = []
+
+    @api.route("/books")
+    class BooksHandler:
+        @api.cache()
+        async def get(self, req, res):
+            calls.append(1)
+            res.text = "books"
+
+    for _ in range(2):
+        status, _, body = _asgi_request(api, "GET", "/books")
+        assert body == b"books"
+    assert len(calls) == 1
+
+
+# metrics tests
+
+def test_metrics_record_routes_statuses_and_phases(base_url):
+    api = API(metrics=Metrics())
+    client = api.test_session()
+
+    @api.route("/hello/{name}")
+    def hello(req, res, name):
+        res.text = f"Hello {name}"
+
+    @api.route("/fail")
+    def fail(req, res):
+        raise ValueError()
+
+    api.add_exception_handler(lambda req, res, exc: setattr(res, "status_code", 500))
+
+    for name in ("john", "jack"):
+        assert client.get(f"{base_url}/hello/{name}").text == f"Hello {name}"
+    client.get(f"{base_url}/fail")
+    client.get(f"{base_url}/missing")
+
+    summary = api.metrics.summary()
+    hello = summary[("GET", "/hello/{name}")]
+    assert hello["count"] == 2
+    assert hello["statuses"] == {200: 2}
+    assert set(hello["phases"]) == {"routing", "middleware", "handler", "serialization"}
+    assert 0 < hello["p50"] <= hello["p95"] <= hello["p99"]
+    assert summary[("GET", "/fail")]["statuses"] == {500: 1}
+    assert summary[("GET", None)]["statuses"] == {404: 1}
+
+
+def test_metrics_group_unknown_methods(base_url):
+    api = API(metrics=Metrics())
+    client = api.test_session()
+
+    api.add_exception_handler(lambda req, res, exc: setattr(res, "status_code", 405))
+
+    @api.route("/home")
+    def home(req, res):
+        res.text = "Home"
+
+    for method in ("GET", "BREW", "PROPFIND", "X" * 100):
+        client.request(method, f"{base_url}/home")
+
+    assert sorted(method for method, _ in api.metrics.summary()) == ["GET", "OTHER"]
+    assert api.metrics.summary()[("OTHER", "/home")]["count"] == 3
+
+
+def test_metrics_endpoint(base_url):
+    api = API(metrics=Metrics(), metrics_path="/metrics")
+    client = api.test_session()
+
+    @api.route("/home")
+    def home(req, res):
+        res.text = "Home"
+
+    client.get(f"{base_url}/home")
+    response = client.get(f"{base_url}/metrics")
+
+    assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    assert 'bumbov_requests_total{method="GET",route="/home",status="200"} 1' in response.text
+    assert 'bumbov_request_duration_seconds_bucket{method="GET",route="/home",le="+Inf"} 1' in response.text
+    assert 'bumbov_request_latency_seconds{method="GET",route="/home",quantile="0.99"}' in response.text
+    assert 'bumbov_request_phase_seconds_total{method="GET",route="/home",phase="handler"}' in response.text
+
+
+def test_metrics_custom_sink_and_asgi():
+    class ListSink(MetricsSink):
+        def __init__(self):
+            self.timings = []
+
+        def record(self, timing):
+            self.timings.append(timing)
+
+    api = API(metrics=ListSink())
+
+    @api.route("/async")
+    async def async_handler(req, res):
+        res.json = {"ok": True}
+
+    status, _, _ = _asgi_request(api, "GET", "/async")
+    timing, = api.metrics.timings
+    assert (status, timing.status, timing.route) == (200, 200, "/async")
+    assert timing.duration >= sum(timing.phases.values()) > 0
+
+
+def test_metrics_disabled_by_default(api, client, base_url):
+    environs = []
+
+    @api.route("/home")
+    def home(req, res):
+        environs.append(req.environ)
+
+    client.get(f"{base_url}/home")
+    assert api.metrics is None
+    assert "bumbov.timing" not in environs[0]
+
+
+# compression tests
+
+def test_compression_middleware(api, client, base_url):
+    api.add_middleware(CompressionMiddleware)
+    payload = [{"id": i, "title": f"Book {i}"} for i in range(100)]
+
+    @api.route("/books")
+    def books(req, res):
+        res.json = payload
+
+    @api.route("/small")
+    def small(req, res):
+        res.text = "small"
+
+    @api.route("/image")
+    def image(req, res):
+        res.body = b"\x89PNG" * 1000
+        res.content_type = "image/png"
+
+    response = client.get(f"{base_url}/books", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert int(response.headers["Content-Length"]) < len(json.dumps(payload))
+    assert json.loads(gzip.decompress(response.content)) == payload
+
+    response = client.get(f"{base_url}/books", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in response.headers
+    assert response.json() == payload
+
+    for path in ("/small", "/image"):
+        response = client.get(f"{base_url}{path}", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in response.headers
+
+
+def test_compression_of_streamed_responses(api, client, base_url, tmpdir):
+    api.add_middleware(CompressionMiddleware)
+    export = tmpdir.join("export.csv")
+    export.write("a,b\n1,2\n" * 1000)
+
+    @api.route("/stream")
+    def stream(req, res):
+        res.ndjson = ({"id": i} for i in range(1000))
+
+    @api.route("/export")
+    def export_handler(req, res):
+        return FileResponse(str(export))
+
+    response = client.get(f"{base_url}/stream", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    body = gzip.decompress(response.content)
+    assert [json.loads(line) for line in body.splitlines()] == [{"id": i} for i in range(1000)]
+
+    response = client.get(f"{base_url}/export", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    assert gzip.decompress(response.content) == b"a,b\n1,2\n" * 1000
+
+
+def test_compressed_responses_get_their_own_etag(api, client, base_url):
+    api.add_middleware(CompressionMiddleware)
+
+    @api.route("/books")
+    @api.cache()
+    def books(req, res):
+        res.text = "Book " * 200
+
+    etag = client.get(f"{base_url}/books", headers={"Accept-Encoding": "identity"}).headers["ETag"]
+    response = client.get(f"{base_url}/books", headers={"Accept-Encoding": "gzip"})
+    gzip_etag = response.headers["ETag"]
+    assert gzip_etag == etag[:-1] + '-gzip"'
+
+    # an ETag of the uncompressed body must not revalidate the compressed one
+    response = client.get(f"{base_url}/books", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert response.status_code == 200
+    assert gzip.decompress(response.content) == b"Book " * 200
+
+    response = client.get(f"{base_url}/books", headers={"Accept-Encoding": "gzip", "If-None-Match": gzip_etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == gzip_etag
+
+    response = client.get(f"{base_url}/books", headers={"Accept-Encoding": "identity", "If-None-Match": etag})
+    assert response.status_code == 304
+
+
+def test_compressed_file_responses_are_not_modified(api, client, base_url, tmpdir):
+    api.add_middleware(CompressionMiddleware)
+    export = tmpdir.join("export.csv")
+    export.write("a,b\n1,2\n" * 150)
+
+    @api.route("/export")
+    def export_handler(req, res):
+        response = FileResponse(str(export))
+        response.headers["ETag"] = '"v1"'
+        return response
+
+    response = client.get(f"{base_url}/export", headers={"Accept-Encoding": "gzip", "If-None-Match": '"v1-gzip"'})
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+def test_precompressed_static_files(tmpdir_factory, base_url):
+    static_dir = tmpdir_factory.mktemp("static")
+    static_dir.join("app.js").write("console.log('hello');\n" * 100)
+    static_dir.join("tiny.js").write("1;")
+
+    api = API(static_dir=str(static_dir), precompress_static=True, static_max_age=3600)
+    client = api.test_session()
+
+    assert static_dir.join("app.js.gz").check()
+    assert not static_dir.join("tiny.js.gz").check()
+    response = client.get(f"{base_url}/static/app.js", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Cache-Control"] == "max-age=3600, public"
+    assert gzip.decompress(response.content) == b"console.log('hello');\n" * 100
+
+
+def test_precompress_command_skips_up_to_date_files(tmpdir):
+    tmpdir.join("main.css").write("body { color: black; }\n" * 100)
+
+    assert compress_main([str(tmpdir), "--no-brotli", "-q"]) == 0
+    compressed = tmpdir.join("main.css.gz")
+    mtime = os.path.getmtime(compressed)
+    assert gzip.decompress(compressed.read_binary()) == tmpdir.join("main.css").read_binary()
+
+    compressed.write_binary(b"unchanged")
+    os.utime(compressed, (mtime, mtime))
+    compress_main([str(tmpdir), "--no-brotli", "-q"])
+    assert compressed.read_binary() == b"unchanged"
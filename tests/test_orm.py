@@ -1,7 +1,12 @@
+import asyncio
+import json
 import sqlite3
+import threading
 
 import pytest
 
+from bumbov.orm import AsyncDatabase, Column, Database, ForeignKey, Index, Query, QueryProfiler, Table
+
 
 def test_create_db(db):
     assert isinstance(db.conn, sqlite3.Connection)
@@ -166,4 +171,825 @@ def test_delete_author(db, Author):
     db.delete(Author, id=1)
 
     with pytest.raises(Exception):
-        db.get(Author, id=1)
\ No newline at end of file
+        db.get(Author, id=1)
+
+# connection handling tests
+
+def test_each_thread_gets_its_own_connection(db):
+    connections = []
+    thread = threading.Thread(target=lambda: connections.append(db.conn))
+    thread.start()
+    thread.join()
+
+    assert db.conn is db.conn
+    assert connections[0] is not db.conn
+
+
+def test_pragmas_and_wal_mode(tmpdir):
+    db = Database(str(tmpdir.join("wal.db")), wal=True, pragmas={"synchronous": "NORMAL", "cache_size": -2000})
+
+    assert db.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert db.conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+    assert db.conn.execute("PRAGMA cache_size").fetchone()[0] == -2000
+
+
+def test_connection_scope_uses_pool(db, Author):
+    db.create(Author)
+
+    with db.connection() as conn:
+        assert db.conn is conn
+        with db.connection() as nested:
+            assert nested is conn
+        db.save(Author(name="John Doe", age=23))
+
+    assert db.conn is not conn
+    with db.connection() as again:
+        assert again is conn
+    assert db.pool._created == 1
+
+
+def test_pool_is_bounded(tmpdir):
+    db = Database(str(tmpdir.join("pool.db")), pool_size=1, pool_timeout=0.01)
+    conn = db.pool.checkout()
+
+    with pytest.raises(Exception):
+        db.pool.checkout()
+
+    db.pool.checkin(conn)
+    assert db.pool.checkout() is conn
+
+
+def test_in_memory_database_is_shared_between_connections(Author):
+    db = Database(":memory:")
+    db.create(Author)
+    db.save(Author(name="John Doe", age=23))
+
+    with db.connection():
+        assert db.get(Author, id=1).name == "John Doe"
+
+
+def test_request_scoped_connection(api, client, db, Author):
+    db.create(Author)
+    api.add_middleware(db.middleware)
+    seen = []
+
+    @api.route("/authors")
+    def authors(req, res):
+        seen.append(db.conn)
+        db.save(Author(name="John Doe", age=23))
+        seen.append(db.conn)
+        res.json = {"count": len(db.all(Author))}
+
+    assert client.get("http://testserver/authors").json() == {"count": 1}
+    assert seen[0] is seen[1]
+    assert db.pool._idle.qsize() == 1
+    assert db.conn is not seen[0]
+
+
+def test_request_scoped_connection_is_released_on_error(api, client, db):
+    api.add_middleware(db.middleware)
+
+    @api.route("/fail")
+    def fail(req, res):
+        db.conn
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        client.get("http://testserver/fail")
+    assert db.pool._idle.qsize() == 1
+
+
+def test_connection_is_released_when_inner_middleware_fails(api, client, Author):
+    from bumbov.middleware import Middleware
+
+    class Forbidden(Middleware):
+        def process_request(self, req):
+            if req.path == "/forbidden":
+                raise PermissionError()
+
+        def process_response(self, req, resp):
+            if req.path == "/broken":
+                raise ValueError()
+
+    db = Database(":memory:", pool_size=2, pool_timeout=0.1)
+    db.create(Author)
+    # the middleware added last wraps the others
+    api.add_middleware(Forbidden)
+    api.add_middleware(db.transaction_middleware)
+
+    @api.route("/{name}")
+    def create_author(req, res, name):
+        db.save(Author(name=name, age=1))
+        res.text = "created"
+
+    for path, error in (("/forbidden", PermissionError), ("/broken", ValueError)) * 2:
+        with pytest.raises(error):
+            client.get(f"http://testserver{path}")
+    assert client.get("http://testserver/ok").text == "created"
+    assert [author.name for author in db.all(Author)] == ["ok"]
+    db.close()
+
+
+def test_connection_is_released_when_commit_fails(api, client, Author):
+    db = Database(":memory:", pool_size=1, pool_timeout=0.1)
+    db.create(Author)
+    api.add_middleware(db.transaction_middleware)
+    commit = db.commit
+    failures = [sqlite3.OperationalError("database is locked")]
+
+    def failing_commit():
+        if failures:
+            raise failures.pop()
+        commit()
+
+    db.commit = failing_commit
+
+    @api.route("/{name}")
+    def create_author(req, res, name):
+        db.save(Author(name=name, age=1))
+        res.text = "created"
+
+    with pytest.raises(sqlite3.OperationalError):
+        client.get("http://testserver/locked")
+    assert client.get("http://testserver/ok").text == "created"
+    assert [author.name for author in db.all(Author)] == ["ok"]
+    db.close()
+
+
+def test_waiting_for_a_connection_does_not_block_the_event_loop(api, Author):
+    db = Database(":memory:", pool_size=1, pool_timeout=2)
+    db.create(Author)
+    api.add_middleware(db.transaction_middleware)
+
+    @api.route("/authors")
+    async def authors(req, res):
+        res.json = [author.name for author in db.all(Author)]
+
+    messages = []
+    held = db.pool.checkout()
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    async def main():
+        scope = {"type": "http", "method": "GET", "path": "/authors", "query_string": b"", "headers": []}
+        request = asyncio.ensure_future(api.asgi(scope, receive, send))
+        # the request waits for the held connection while the loop keeps running
+        await asyncio.sleep(0.05)
+        assert not request.done()
+        db.pool.checkin(held)
+        await request
+
+    asyncio.run(main())
+    assert messages[0]["status"] == 200
+    db.close()
+
+
+# foreign key loading tests
+
+def _record_queries(db):
+    queries = []
+    db.conn.set_trace_callback(queries.append)
+    return queries
+
+
+def _save_books(db, Author, Book, count=10):
+    db.create(Author)
+    db.create(Book)
+    john = Author(name="John Doe", age=23)
+    jack = Author(name="Jack Doe", age=25)
+    db.save(john)
+    db.save(jack)
+    for i in range(count):
+        db.save(Book(author=john if i % 2 else jack, published=True, title=f"Book {i}"))
+
+
+def test_all_loads_foreign_keys_in_one_query(db, Author, Book):
+    _save_books(db, Author, Book)
+    queries = _record_queries(db)
+
+    books = db.all(Book)
+
+    assert len(queries) == 2
+    assert "WHERE id IN" in queries[1]
+    assert {book.author.name for book in books} == {"John Doe", "Jack Doe"}
+    assert books[1].author is books[3].author
+
+
+def test_lazy_foreign_keys_are_loaded_on_access(db, Author, Book):
+    _save_books(db, Author, Book)
+    queries = _record_queries(db)
+
+    books = db.all(Book, lazy=True)
+    assert len(queries) == 1
+
+    assert books[1].author.name == "John Doe"
+    assert books[3].author is books[1].author
+    assert len(queries) == 2
+
+
+def test_null_foreign_key(db, Author, Book):
+    db.create(Author)
+    db.create(Book)
+    db.conn.execute("INSERT INTO book (title, published, author_id) VALUES ('Anonymous', 1, NULL)")
+
+    assert db.get(Book, id=1).author is None
+    assert db.all(Book)[0].author is None
+
+
+def test_sql_is_prepared_once_per_class(db, Author, Book, monkeypatch):
+    db.create(Author)
+    db.create(Book)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("inspect.getmembers should not be called per query")
+
+    monkeypatch.setattr("bumbov.orm.inspect.getmembers", fail)
+
+    john = Author(name="John Doe", age=23)
+    db.save(john)
+    db.save(Book(author=john, published=True, title="My Book"))
+    john.age = 24
+    db.update(john)
+
+    assert db.get(Book, id=1).author.age == 24
+    assert Book._select_fields == ["id", "author_id", "published", "title"]
+
+
+# bulk operation tests
+
+def test_bulk_save_populates_ids(db, Author, Book):
+    db.create(Author)
+    db.create(Book)
+    db.save(Author(name="Existing", age=50))
+
+    authors = [Author(name=f"Author {i}", age=i) for i in range(25)]
+    db.bulk_save(authors, batch_size=10)
+
+    assert [author.id for author in authors] == list(range(2, 27))
+    assert db.get(Author, id=26).name == "Author 24"
+
+    books = [Book(author=authors[i], published=True, title=f"Book {i}") for i in range(3)]
+    db.bulk_save(books)
+    assert db.get(Book, id=3).author.name == "Author 2"
+
+
+def test_bulk_save_is_one_transaction(db, Author):
+    db.create(Author)
+    queries = _record_queries(db)
+
+    db.bulk_save([Author(name=f"Author {i}", age=i) for i in range(100)])
+
+    assert queries.count("COMMIT") == 1
+    assert len(db.all(Author)) == 100
+
+
+def test_bulk_save_rolls_back_on_error(db, Author):
+    db.create(Author)
+    db.save(Author(name="Existing", age=50))
+
+    class NotStorable:
+        pass
+
+    with pytest.raises(sqlite3.Error):
+        db.bulk_save([Author(name="New", age=1), Author(name="Broken", age=NotStorable())])
+
+    assert len(db.all(Author)) == 1
+
+
+def test_bulk_update_and_delete(db, Author):
+    db.create(Author)
+    authors = [Author(name=f"Author {i}", age=i) for i in range(10)]
+    db.bulk_save(authors)
+
+    for author in authors:
+        author.age += 100
+    db.bulk_update(authors, batch_size=3)
+    assert {author.age for author in db.all(Author)} == set(range(100, 110))
+
+    db.bulk_delete(Author, [author.id for author in authors[:5]])
+    db.bulk_delete(Author, authors[5:7])
+    assert {author.name for author in db.all(Author)} == {"Author 7", "Author 8", "Author 9"}
+
+
+# transaction tests
+
+def test_transaction_commits_once(db, Author):
+    db.create(Author)
+    queries = _record_queries(db)
+
+    with db.transaction():
+        for i in range(10):
+            db.save(Author(name=f"Author {i}", age=i))
+        authors = db.all(Author)
+        authors[0].age = 100
+        db.update(authors[0])
+
+    assert queries.count("COMMIT") == 1
+    assert db.get(Author, id=1).age == 100
+
+
+def test_transaction_rolls_back_on_error(db, Author):
+    db.create(Author)
+
+    with pytest.raises(ValueError):
+        with db.transaction():
+            db.save(Author(name="John Doe", age=23))
+            raise ValueError()
+
+    assert db.all(Author) == []
+
+
+def test_nested_transactions_use_savepoints(db, Author):
+    db.create(Author)
+
+    with db.transaction():
+        db.save(Author(name="Outer", age=1))
+        with pytest.raises(ValueError):
+            with db.transaction():
+                db.save(Author(name="Inner", age=2))
+                raise ValueError()
+        with db.transaction():
+            db.save(Author(name="Second inner", age=3))
+
+    assert {author.name for author in db.all(Author)} == {"Outer", "Second inner"}
+
+
+def test_transaction_middleware(api, client, db, Author):
+    db.create(Author)
+    api.add_middleware(db.transaction_middleware)
+    api.add_exception_handler(lambda req, res, exc: setattr(res, "status_code", 500))
+
+    @api.route("/authors/{name}")
+    def create_author(req, res, name):
+        db.save(Author(name=name, age=1))
+        db.save(Author(name=name, age=2))
+        if name == "handled":
+            raise ValueError()
+
+    assert client.get("http://testserver/authors/ok").status_code == 200
+    assert client.get("http://testserver/authors/handled").status_code == 500
+
+    assert [author.name for author in db.all(Author)] == ["ok", "ok"]
+    assert db.pool._idle.qsize() == 1
+
+
+def test_transaction_middleware_rolls_back_unhandled_errors(api, client, db, Author):
+    db.create(Author)
+    api.add_middleware(db.transaction_middleware)
+
+    @api.route("/fail")
+    def fail(req, res):
+        db.save(Author(name="John Doe", age=23))
+        raise ValueError()
+
+    with pytest.raises(ValueError):
+        client.get("http://testserver/fail")
+
+    assert db.all(Author) == []
+    assert db.pool._idle.qsize() == 1
+
+
+# streaming query tests
+
+def test_iterate_fetches_in_chunks(db, Author, Book):
+    _save_books(db, Author, Book, count=25)
+    queries = _record_queries(db)
+
+    books = db.iterate(Book, chunk_size=10)
+    first = next(books)
+    assert first.title == "Book 0"
+    assert first.author.name == "Jack Doe"
+    assert len(queries) == 2
+
+    rest = list(books)
+    assert [book.id for book in rest] == list(range(2, 26))
+    assert rest[-2].author.name == "John Doe"
+
+
+def test_iterate_limit_offset_and_keyset(db, Author):
+    db.create(Author)
+    db.bulk_save([Author(name=f"Author {i}", age=i) for i in range(20)])
+
+    assert [a.id for a in db.iterate(Author, limit=5)] == [1, 2, 3, 4, 5]
+    assert [a.id for a in db.iterate(Author, limit=3, offset=10)] == [11, 12, 13]
+    assert [a.id for a in db.iterate(Author, offset=17)] == [18, 19, 20]
+    assert [a.id for a in db.iterate(Author, after=15, limit=3)] == [16, 17, 18]
+
+
+def test_iterate_streams_into_a_response(api, client, db, Author):
+    db.create(Author)
+    db.bulk_save([Author(name=f"Author {i}", age=i) for i in range(1000)])
+
+    @api.route("/authors.ndjson")
+    def export(req, res):
+        res.ndjson = ({"id": a.id, "name": a.name} for a in db.iterate(Author, chunk_size=100))
+
+    lines = client.get("http://testserver/authors.ndjson").text.splitlines()
+    assert len(lines) == 1000
+    assert json.loads(lines[-1]) == {"id": 1000, "name": "Author 999"}
+
+
+# query builder tests
+
+def test_query_filter_order_and_limit(db, Author, Book):
+    _save_books(db, Author, Book, count=10)
+
+    books = db.query(Book).filter(title__in=["Book 1", "Book 2", "Book 3"]).order_by("-id").all()
+    assert [book.title for book in books] == ["Book 3", "Book 2", "Book 1"]
+
+    books = db.query(Book).filter(id__gt=2, id__lte=8).order_by("-id").limit(2).offset(1).all()
+    assert [book.id for book in books] == [7, 6]
+
+    john = db.get(Author, id=1)
+    books = db.query(Book).filter(author=john).all()
+    assert {book.id for book in books} == {2, 4, 6, 8, 10}
+    assert all(book.author.name == "John Doe" for book in books)
+
+    assert db.query(Book).filter(title="Missing").first() is None
+    assert db.query(Book).order_by("-title").first().title == "Book 9"
+
+
+def test_query_projection(db, Author, Book):
+    _save_books(db, Author, Book, count=3)
+    queries = _record_queries(db)
+
+    books = db.query(Book).only("title").order_by("id").all()
+
+    assert queries == ["SELECT id, title FROM book ORDER BY id;"]
+    assert [book.title for book in books] == ["Book 0", "Book 1", "Book 2"]
+    assert books[0].id == 1
+
+
+def test_query_count_and_exists(db, Author, Book):
+    _save_books(db, Author, Book, count=10)
+    queries = _record_queries(db)
+
+    assert db.query(Book).count() == 10
+    assert db.query(Book).filter(author_id=1).count() == 5
+    assert db.query(Book).limit(3).count() == 3
+    assert db.query(Book).filter(title="Book 4").exists() is True
+    assert db.query(Book).filter(title="Missing").exists() is False
+
+    assert queries[0] == "SELECT COUNT(*) FROM book;"
+    assert queries[3] == "SELECT 1 FROM book WHERE title = 'Book 4' LIMIT 1;"
+
+
+def test_query_null_filters_and_unknown_fields(db, Author, Book):
+    db.create(Author)
+    db.create(Book)
+    db.conn.execute("INSERT INTO book (title, published, author_id) VALUES ('Anonymous', 1, NULL)")
+
+    assert db.query(Book).filter(author=None).count() == 1
+    assert db.query(Book).filter(author__isnull=False).count() == 0
+    with pytest.raises(AttributeError):
+        db.query(Book).filter(publisher="Someone")
+
+
+def test_query_statements_are_cached_by_shape(db, Author):
+    db.create(Author)
+    Query.statements.clear()
+
+    db.query(Author).filter(age__gt=10).all()
+    db.query(Author).filter(age__gt=20).all()
+    db.query(Author).filter(age__in=[1, 2]).all()
+    db.query(Author).filter(age__in=[3, 4]).all()
+
+    assert len(Query.statements) == 2
+
+
+# index tests
+
+def test_index_declarations(db, Author):
+    class Review(Table):
+        author = ForeignKey(Author)
+        slug = Column(str, unique=True)
+        score = Column(int, index=True)
+        text = Column(str)
+        by_author_and_score = Index("author", "score")
+
+    assert Review._get_create_index_sqls() == [
+        "CREATE INDEX IF NOT EXISTS review_author_id_idx ON review (author_id)",
+        "CREATE INDEX IF NOT EXISTS review_score_idx ON review (score)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS review_slug_idx ON review (slug)",
+        "CREATE INDEX IF NOT EXISTS review_by_author_and_score ON review (author_id, score)",
+    ]
+
+    db.create(Author)
+    db.create(Review)
+    indexes = {row[0] for row in db.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"review_author_id_idx", "review_score_idx", "review_slug_idx", "review_by_author_and_score"} <= indexes
+
+    db.save(Review(author=None, slug="first", score=1, text=""))
+    with pytest.raises(sqlite3.IntegrityError):
+        db.save(Review(author=None, slug="first", score=2, text=""))
+
+
+def test_explain_shows_index_usage(db, Author, Book):
+    db.create(Author)
+    db.create(Book)
+
+    plan = db.query(Book).filter(author_id=1).explain()
+    assert any("USING INDEX book_author_id_idx" in detail for detail in plan)
+
+    plan = db.explain("SELECT * FROM book WHERE title = ?", ["Dune"])
+    assert any(detail.startswith("SCAN book") for detail in plan)
+
+
+# row instance tests
+
+def test_instances_use_slots(db, Author, Book):
+    _save_books(db, Author, Book, count=2)
+    book = db.get(Book, id=1)
+
+    assert not hasattr(book, "__dict__")
+    assert Author.name.type == str
+    with pytest.raises(AttributeError):
+        book.publisher = "Someone"
+
+    book.title = "Renamed"
+    db.update(book)
+    assert db.get(Book, id=1).title == "Renamed"
+    assert Author(name="Partial").age is None
+
+
+def test_query_values_and_tuples(db, Author, Book):
+    _save_books(db, Author, Book, count=3)
+
+    assert db.query(Book).order_by("id").values("title", "author") == [
+        {"title": "Book 0", "author": 2},
+        {"title": "Book 1", "author": 1},
+        {"title": "Book 2", "author": 2},
+    ]
+    assert db.query(Author).filter(id=1).values() == [{"id": 1, "age": 23, "name": "John Doe"}]
+    assert db.query(Book).filter(author_id=1).tuples("id", "title") == [(2, "Book 1")]
+
+
+def test_get_uses_second_level_cache(Author):
+    db = Database(":memory:", cache_size=10, cache_ttl=60)
+    db.create(Author)
+    db.save(Author(name="John Doe", age=23))
+    queries = _record_queries(db)
+
+    first = db.get(Author, id=1)
+    second = db.get(Author, id=1)
+    assert len(queries) == 1
+    assert first is not second
+    assert second.name == "John Doe"
+    assert (db.cache.hits, db.cache.misses) == (1, 1)
+
+    first.age = 24
+    db.update(first)
+    assert db.get(Author, id=1).age == 24
+
+    db.delete(Author, id=1)
+    with pytest.raises(Exception):
+        db.get(Author, id=1)
+    db.close()
+
+
+def test_second_level_cache_is_invalidated_when_deleting_an_instance(Author):
+    db = Database(":memory:", cache_size=10)
+    db.create(Author)
+    author = Author(name="John Doe", age=23)
+    db.save(author)
+
+    db.get(Author, author.id)
+    db.delete(author, author.id)
+    with pytest.raises(Exception):
+        db.get(Author, author.id)
+    db.close()
+
+
+def test_second_level_cache_normalises_string_ids(Author):
+    db = Database(":memory:", cache_size=10)
+    db.create(Author)
+    author = Author(name="John Doe", age=23)
+    db.save(author)
+
+    # route parameters such as /authors/{id} arrive as strings
+    assert db.get(Author, "1").age == 23
+    author.age = 24
+    db.update(author)
+    assert db.get(Author, "1").age == 24
+
+    db.delete(Author, author.id)
+    with pytest.raises(Exception):
+        db.get(Author, "1")
+    db.close()
+
+
+def test_second_level_cache_skips_uncommitted_rows(Author, tmpdir):
+    db = Database(str(tmpdir.join("cache.db")), cache_size=10, wal=True)
+    db.create(Author)
+    db.save(Author(name="committed", age=23))
+    seen = []
+
+    def read():
+        seen.append(db.get(Author, id=1).name)
+
+    with pytest.raises(ValueError):
+        with db.transaction():
+            author = db.get(Author, id=1)
+            author.name = "uncommitted"
+            db.update(author)
+            assert db.get(Author, id=1).name == "uncommitted"
+            thread = threading.Thread(target=read)
+            thread.start()
+            thread.join()
+            raise ValueError()
+
+    assert seen == ["committed"]
+    db.close()
+
+
+def test_second_level_cache_is_cleared_on_rollback(Author):
+    db = Database(":memory:", cache_size=10)
+    db.create(Author)
+    db.save(Author(name="John Doe", age=23))
+
+    with pytest.raises(ValueError):
+        with db.transaction():
+            author = db.get(Author, id=1)
+            author.age = 99
+            db.update(author)
+            assert db.get(Author, id=1).age == 99
+            raise ValueError()
+
+    assert len(db.cache) == 0
+    assert db.get(Author, id=1).age == 23
+    db.close()
+
+
+def test_identity_map_scope(db, Author, Book):
+    _save_books(db, Author, Book, count=2)
+    queries = _record_queries(db)
+
+    with db.identity_map():
+        book = db.get(Book, id=1)
+        assert db.get(Book, id=1) is book
+        assert db.get(Author, id=book.author.id) is book.author
+        assert len(queries) == 2
+
+        db.delete(Book, id=1)
+        with pytest.raises(Exception):
+            db.get(Book, id=1)
+
+    assert db.get(Book, id=2) is not db.get(Book, id=2)
+
+
+def test_identity_map_per_request(api, client, Author):
+    db = Database(":memory:", identity_map=True)
+    db.create(Author)
+    db.save(Author(name="John Doe", age=23))
+    api.add_middleware(db.middleware)
+
+    @api.route("/same")
+    def same(req, res):
+        res.text = str(db.get(Author, id=1) is db.get(Author, id=1))
+
+    assert client.get("http://testserver/same").text == "True"
+    assert db._identity_map.get() is None
+    db.close()
+
+
+def test_async_database(db, Author, Book):
+    adb = AsyncDatabase(db, readers=2)
+
+    async def main():
+        await adb.create(Author)
+        await adb.create(Book)
+        john = Author(name="John Doe", age=23)
+        await adb.save(john)
+        await adb.bulk_save([Book(title=f"Book {i}", published=True, author=john) for i in range(5)])
+
+        john.age = 24
+        await adb.update(john)
+        await adb.delete(Book, id=5)
+
+        author, books = await asyncio.gather(adb.get(Author, 1), adb.all(Book))
+        return author, books, [book.id async for book in adb.iterate(Book, chunk_size=2, limit=3)]
+
+    author, books, ids = asyncio.run(main())
+    adb.close()
+
+    assert author.age == 24
+    assert [book.title for book in books] == ["Book 0", "Book 1", "Book 2", "Book 3"]
+    assert books[0].author.name == "John Doe"
+    assert ids == [1, 2, 3]
+    assert adb._connections == []
+
+
+def test_async_database_never_loads_lazily(Author, Book):
+    db = Database(":memory:", lazy=True)
+    _save_books(db, Author, Book, count=2)
+    adb = AsyncDatabase(db)
+
+    async def main():
+        book = await adb.get(Book, 1)
+        books = await adb.all(Book)
+        return [book] + books + [book async for book in adb.iterate(Book)]
+
+    books = asyncio.run(main())
+    adb.close()
+
+    queries = _record_queries(db)
+    assert {book.author.name for book in books} == {"John Doe", "Jack Doe"}
+    assert queries == []
+    db.close()
+
+
+def test_async_database_writes_run_on_one_thread(db, Author):
+    adb = AsyncDatabase(db)
+
+    async def main():
+        await adb.create(Author)
+        await asyncio.gather(*(adb.save(Author(name=str(i), age=i)) for i in range(10)))
+        threads = await asyncio.gather(*(adb.write(threading.get_ident) for _ in range(5)))
+        return threads, await adb.read(db.query(Author).count)
+
+    threads, count = asyncio.run(main())
+    adb.close()
+
+    assert len(set(threads)) == 1
+    assert threads[0] != threading.get_ident()
+    assert count == 10
+
+
+def test_query_profiler_records_statements(db, Author, Book):
+    _save_books(db, Author, Book, count=4)
+    db.profiler = QueryProfiler()
+
+    with db.profiler.profile() as profile:
+        db.all(Book)
+        db.query(Book).filter(title__in=["Book 0", "Book 1"]).count()
+        db.bulk_delete(Book, [3, 4])
+
+    select_books, select_authors, count, delete = profile.queries
+    assert select_books.sql == Book._select_all_sql
+    assert (select_books.params, select_books.rows) == (0, 4)
+    assert (select_authors.params, select_authors.rows) == (2, 2)
+    assert (count.params, count.rows) == (2, 1)
+    assert (delete.sql, delete.params, delete.rows) == (Book._delete_sql, 2, 2)
+    assert profile.summary()["count"] == 4
+    assert db.profiler.count == 4
+
+
+def test_query_profiler_logs_slow_queries_and_n_plus_one(db, Author, Book, caplog):
+    _save_books(db, Author, Book, count=6)
+    db.profiler = QueryProfiler(slow_query_threshold=0, n_plus_one_threshold=5)
+
+    with caplog.at_level("WARNING", logger="bumbov.orm"):
+        with db.profiler.profile() as profile:
+            for id in range(1, 7):
+                db.get(Book, id=id, lazy=True)
+
+    sql = Book._get_select_where_sql(1)[0]
+    assert profile.n_plus_one == [(sql, 6)]
+    messages = [record.getMessage() for record in caplog.records]
+    assert sum(message.startswith("Slow query") for message in messages) == 6
+    assert f"Possible N+1 query, executed 6 times: {sql}" in messages
+
+
+def test_nested_profiles_do_not_hide_request_queries(Author, Book):
+    from bumbov.api import API
+    from bumbov.metrics import Metrics
+
+    db = Database(":memory:", profiler=QueryProfiler())
+    _save_books(db, Author, Book, count=2)
+    api = API(metrics=Metrics())
+    api.add_middleware(db.middleware)
+
+    @api.route("/books")
+    def books(req, res):
+        with db.profiler.profile() as profile:
+            db.all(Book)
+        db.all(Book)
+        res.json = {"queries": profile.summary()["count"]}
+
+    assert api.test_session().get("http://testserver/books").json() == {"queries": 2}
+    assert api.metrics.summary()[("GET", "/books")]["queries"] == 4
+    db.close()
+
+
+def test_query_summary_is_attached_to_request_metrics(Author, Book):
+    from bumbov.api import API
+    from bumbov.metrics import Metrics
+
+    db = Database(":memory:", profiler=QueryProfiler())
+    _save_books(db, Author, Book, count=2)
+    api = API(metrics=Metrics())
+    api.add_middleware(db.middleware)
+
+    @api.route("/books")
+    def books(req, res):
+        res.json = [book.title for book in db.all(Book)]
+
+    api.test_session().get("http://testserver/books")
+
+    assert api.metrics.summary()[("GET", "/books")]["queries"] == 2
+    assert "bumbov_request_queries_total{method=\"GET\",route=\"/books\"} 2" in api.metrics.render()
+    db.close()